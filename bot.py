@@ -5,56 +5,71 @@ import discord
 import requests
 import random
 from sys import exit, argv
-from os import path, makedirs
+from os import path
 from datetime import datetime, timedelta
-from io import BytesIO
 
 from urlparse import urlparse
 from dateutil.parser import parse
-from PIL import Image
 import threading
+import atexit
+import signal
 import pycountry
 import cleverbot
 
-from pcbot import Config
+from pcbot import Config, JournalConfig, SQLiteConfig, WorkerPool, CommandRegistry, HTTPClient, \
+    TTLCache, SingleFlight, RateLimiter, CircuitBreaker, Scheduler, UserIndex, StoryStore, \
+    AvatarStore, SessionPool, Outbox
+from pcbot.commands import COST_STORAGE, COST_EXTERNAL
+from pcbot.circuit import CircuitOpenError, DeadlineExceeded, Deadline, deadline_scope, current_deadline, time_left
+from pcbot.ratelimit import RateLimitExceeded
+from pcbot.workers import Task, KeyedExecutor, fan_out, TaskTimeout
+from pcbot.wordlist import WordList, build as build_word_list
+from pcbot.games import WordSearch
 
 __git_url__ = "https://github.com/PcBoy111/PC-BOT"
 
 
-class OnMessage(threading.Thread):
+def process_message(message):
     """
-    Thread for handling commands.
+    Handle a command and send any reply. Called by the message worker pool.
 
     Logs are printed to the console only, with the format: time@user> command
     Example: 29.12.15 22:38:18@PC> !stats -PC
-    """
-
-    def __init__(self, message):
-        threading.Thread.__init__(self)
-        self.message = message
 
-    def run(self):
-        send_message = ""
-
-        if self.message.content:
-            if not self.message.channel.is_private:
-                send_message = handle_message(self.message)
-            else:
-                send_message = handle_pm(self.message)
-
-        # If a message can be sent and it isn't a wordsearch element
-        if send_message:
-            send_message = send_message.encode('utf-8')
-
-            # Log received command to console (old format to save myself)
-            print("%s@%s> %s" % (
-                datetime.now().strftime("%d.%m.%y %H:%M:%S"),
-                self.message.author.name,
-                self.message.content
-            ))
+    :param message: a discord class Message received (required)
+    """
+    send_message = ""
 
-            # Send any received message to the channel as @user <message ...>
-            client.send_message(self.message.channel, self.message.author.mention() + " " + send_message)
+    if message.content:
+        # Every outbound call made for this message shares one deadline
+        with deadline_scope(Deadline(get_setting("message_deadline"))):
+            try:
+                if not message.channel.is_private:
+                    send_message = handle_message(message)
+                else:
+                    send_message = handle_pm(message)
+            except CircuitOpenError as e:
+                send_message = "%s is not responding right now, try again later. :thumbsdown:" % e.service
+            except (DeadlineExceeded, TaskTimeout):
+                send_message = "This is taking too long, try again later. :thumbsdown:"
+            except requests.RequestException:
+                send_message = "Could not reach the service, try again later. :thumbsdown:"
+            except RateLimitExceeded:
+                send_message = "Too many requests right now, try again later. :thumbsdown:"
+
+    # If a message can be sent and it isn't a wordsearch element
+    if send_message:
+        send_message = send_message.encode('utf-8')
+
+        # Log received command to console (old format to save myself)
+        print("%s@%s> %s" % (
+            datetime.now().strftime("%d.%m.%y %H:%M:%S"),
+            message.author.name,
+            message.content
+        ))
+
+        # Send any received message to the channel as @user <message ...>
+        outbox.put(message.channel, message.author.mention() + " " + send_message)
 
 # Initialize the client
 client = discord.Client()
@@ -78,28 +93,205 @@ if len(argv) > 3:
 else:
     osu_api = raw_input("Enter a valid osu! API key for osu! functions (enter nothing to disable): ")
 
-usage = {
-    "!pcbot [--git | --reddit | --uptime]": "display commands",
-    "!lmgtfy <query ...>": "let me google that for you~",
-    "!define <word/phrase ...>": "define this!",
-    "!profile [-m | --me] <user> [*tag]": "sends link to osu! profile (assign with -m)",
-    "!stats <user>": "displays various stats for user",
-    "!roll [range]": "roll dice",
-    "!yn [--set | --global-set [<yes> <no>]]": "yes or no (alternatively multiple choice)",
-    "!story": "toggle story mode",
-    "!wordsearch [-a | --auto] [-s | --stop]": "start a wordsearch or stop with --stop",
-    "!remindme <at> <time ...>": "reminds you at any time specified",
-    "!pasta <copypasta | --add <pastaname> <pasta ...>>": "pasta"
+# Store bot wide settings, any missing setting falls back to default_settings
+default_settings = {
+    "message_workers": 8,
+    "message_queue_size": 256,
+    "config_write_delay": 5,
+    "storage": "journal",
+    "config_snapshot_cache": True,
+    "http_pool_size": 10,
+    "http_connect_timeout": 3.05,
+    "http_read_timeout": 10,
+    "lookup_workers": 16,
+    "lookup_queue_size": 256,
+    "lookup_concurrency": 4,
+    "message_deadline": 15,
+    "breaker_failures": 5,
+    "breaker_reset": 30,
+    "cleverbot_timeout": 10,
+    "cleverbot_concurrency": 4,
+    "cleverbot_queue_size": 16,
+    "cleverbot_channel_queue_size": 4,
+    "cleverbot_sessions": 64,
+    "cleverbot_idle_timeout": 1800,
+    "define_cache_size": 1024,
+    "define_cache_ttl": 86400,
+    "define_cache_negative_ttl": 600,
+    "define_cache_persist": True,
+    "osu_rate": 10,
+    "osu_burst": 20,
+    "osu_max_wait": 5,
+    "osu_cache_size": 2048,
+    "osu_cache_ttl": {
+        "get_user": 60,
+        "get_scores": 60,
+        "get_beatmaps": 300,
+        "ranked_beatmaps": 86400
+    },
+    "story_max_length": 100000,
+    "story_max_memory": 1000000,
+    "story_spill_size": 65536,
+    "story_idle_timeout": 86400,
+    "sweep_interval": 600,
+    "wordsearch_idle_timeout": 86400,
+    "avatar_processes": 2,
+    "avatar_max_size": 512,
+    "avatar_max_bytes": 262144,
+    "avatar_timeout": 30,
+    "outbox_window": 0.2,
+    "outbox_channel_rate": 1,
+    "outbox_channel_burst": 5,
+    "outbox_global_rate": 20,
+    "outbox_global_burst": 40
 }
+settings = Config(
+    config=dict(default_settings),
+    filename="settings"
+)
+settings.load()
+
+
+def get_setting(name):
+    """
+    :param name: setting to look up (required)
+    :return: the configured value or the default value
+    """
+    value = settings.get(name)
+
+    if value is None:
+        return default_settings.get(name)
+
+    return value
+
+
+# Handle messages with a fixed amount of worker threads
+message_pool = WorkerPool(
+    workers=get_setting("message_workers"),
+    queue_size=get_setting("message_queue_size"),
+    name="message"
+)
+
+# Run outbound lookups of a single message concurrently
+lookup_pool = WorkerPool(
+    workers=get_setting("lookup_workers"),
+    queue_size=get_setting("lookup_queue_size"),
+    name="lookup"
+)
+
+# Run messages changing the state of a channel in order, one at a time per channel
+channel_executor = KeyedExecutor(message_pool)
+
+# Send every message from a single queue, in order per channel and paced to stay within rate limits
+outbox = Outbox(
+    client.send_message,
+    window=get_setting("outbox_window"),
+    channel_rate=get_setting("outbox_channel_rate"),
+    channel_burst=get_setting("outbox_channel_burst"),
+    global_rate=get_setting("outbox_global_rate"),
+    global_burst=get_setting("outbox_global_burst")
+)
+
+# Send all outbound HTTP requests through pooled keep-alive sessions
+web = HTTPClient(
+    pool_size=get_setting("http_pool_size"),
+    connect_timeout=get_setting("http_connect_timeout"),
+    read_timeout=get_setting("http_read_timeout")
+)
+
+# Fail fast while an external service is down
+osu_breaker = CircuitBreaker(
+    "osu!",
+    failure_threshold=get_setting("breaker_failures"),
+    reset_timeout=get_setting("breaker_reset")
+)
+urbandictionary_breaker = CircuitBreaker(
+    "Urban Dictionary",
+    failure_threshold=get_setting("breaker_failures"),
+    reset_timeout=get_setting("breaker_reset")
+)
+cleverbot_breaker = CircuitBreaker(
+    "Cleverbot",
+    failure_threshold=get_setting("breaker_failures"),
+    reset_timeout=get_setting("breaker_reset"),
+    ignored=(RateLimitExceeded,)
+)
+
+# Share the osu! API rate limit, letting commands through before link previews
+PRIORITY_COMMAND = 0
+PRIORITY_PREVIEW = 1
+osu_limiter = RateLimiter(
+    rate=get_setting("osu_rate"),
+    burst=get_setting("osu_burst"),
+    max_wait=get_setting("osu_max_wait")
+)
+
+# Cache osu! API responses
+osu_cache = TTLCache(maxsize=get_setting("osu_cache_size"))
+
+# Cache formatted !define replies by term
+define_cache = TTLCache(
+    maxsize=get_setting("define_cache_size"),
+    ttl=get_setting("define_cache_ttl")
+)
+
+
+# Saves run both periodically and on exit, and write the same temporary file
+define_cache_save_lock = threading.Lock()
+
+
+def save_define_cache():
+    """ Write the !define cache to define-cache.yml """
+    with define_cache_save_lock:
+        Config(config=define_cache.snapshot(), filename="define-cache").save()
+
+
+def load_define_cache():
+    """ Fill the !define cache from define-cache.yml """
+    define_cache_store = Config(config={}, filename="define-cache")
+    define_cache_store.load()
+    define_cache.restore(define_cache_store.get())
+
+
+# Share identical external lookups that are in flight at the same time
+in_flight = SingleFlight()
+
+# Config classes for large keyed stores, chosen with the storage setting
+storage_backends = {
+    "yaml": Config,
+    "journal": JournalConfig,
+    "sqlite": SQLiteConfig
+}
+
+
+def keyed_config(config, filename):
+    """
+    Create a write-behind config for a store keyed by user or name,
+    using the storage backend set in settings
+
+    :param config: initializer for the config (required)
+    :param filename: filename for the config, without extension (required)
+    :return: a Config, JournalConfig or SQLiteConfig
+    """
+    backend = storage_backends.get(get_setting("storage"), JournalConfig)
+    return backend(config=config, filename=filename, write_behind=True, max_delay=get_setting("config_write_delay"),
+                   snapshot_cache=get_setting("config_snapshot_cache"))
+
+
+# Register commands by trigger
+commands = CommandRegistry()
 
 # Store !yn info in multiple channels
 yn_set = Config(
     config={"default": ["yes", "no"]},
-    filename="yn"
+    filename="yn",
+    write_behind=True,
+    max_delay=get_setting("config_write_delay"),
+    snapshot_cache=get_setting("config_snapshot_cache")
 )
 
 # Store osu! user links
-osu_users = Config(
+osu_users = keyed_config(
     config={},
     filename="osu-users"
 )
@@ -107,34 +299,112 @@ osu_users = Config(
 # Store server wide settings
 reddit_settings = Config(
     config={"default": False},
-    filename="reddit_settings"
+    filename="reddit_settings",
+    write_behind=True,
+    max_delay=get_setting("config_write_delay"),
+    snapshot_cache=get_setting("config_snapshot_cache")
 )
 
-# Store story info in multiple channels
-story_enabled = {}
-story = {}
+# Store story info in multiple channels, spilling long stories to disk
+stories = StoryStore(
+    max_length=get_setting("story_max_length"),
+    max_memory=get_setting("story_max_memory"),
+    spill_size=get_setting("story_spill_size"),
+    idle_timeout=get_setting("story_idle_timeout")
+)
 
-# Store wordsearch in multiple channels
+# Store wordsearch in multiple channels, formats as channel_id: WordSearch
 wordsearch = {}
 wordsearch_characters = Config(
     config={"default": "abcdefghijklmnopqrstuvwxyz"},
-    filename="wordsearch_chars"
+    filename="wordsearch_chars",
+    write_behind=True,
+    max_delay=get_setting("config_write_delay"),
+    snapshot_cache=get_setting("config_snapshot_cache")
 )
-wordsearch_words = []
 
+# Channel of the wordsearch each user is hosting, formats as user_id: channel_id
+wordsearch_hosts = {}
+
+# Sets of the characters in every charset in use, formats as charset: frozenset
+charset_validators = {}
 
-# Get each word in english dictionary and store it in wordsearch_words
+
+def wordsearch_charset(channel_id):
+    """
+    :param channel_id: id of the channel (required)
+    :return: frozenset of the characters allowed in the channel's wordsearch
+    """
+    charset = wordsearch_characters.get(channel_id) or wordsearch_characters.get("default")
+    valid_chars = charset_validators.get(charset)
+
+    if valid_chars is None:
+        valid_chars = frozenset(charset)
+        charset_validators[charset] = valid_chars
+
+    return valid_chars
+
+
+def end_wordsearch(channel_id):
+    """
+    Remove the wordsearch of a channel and its host from wordsearch_hosts
+
+    :param channel_id: id of the channel (required)
+    """
+    game = wordsearch.pop(channel_id, None)
+
+    if game and wordsearch_hosts.get(game.host_id) == channel_id:
+        wordsearch_hosts.pop(game.host_id)
+
+
+def expire_wordsearch(channel_id):
+    """
+    End the wordsearch of a channel if it is still idle. Runs in order with the channel's other messages.
+
+    :param channel_id: id of the channel (required)
+    """
+    game = wordsearch.get(channel_id)
+
+    if game and game.idle(get_setting("wordsearch_idle_timeout")):
+        end_wordsearch(channel_id)
+        print("Evicted idle wordsearch in channel %s" % channel_id)
+
+
+# Memory mapped english dictionary, bundled with pcbot (see pcbot/wordlist.py)
+# Without a bundled list, one is downloaded next to the configs instead of into the package
+wordsearch_words = WordList()
+if not wordsearch_words.exists():
+    wordsearch_words = WordList("wordsearch_words")
+
+wordsearch_words_lock = threading.Lock()
+
+
+# Build the word list from the online dictionary when it is missing
 def set_wordsearch_words():
-    global wordsearch_words
+    with wordsearch_words_lock:
+        # Another channel may have built it while this one waited
+        if wordsearch_words.exists():
+            return
+
+        word_request = web.get("http://www.mieliestronk.com/corncob_lowercase.txt")
+        word_request.raise_for_status()
+        build_word_list(word_request.text.split("\n"), wordsearch_words.filename)
 
-    word_request = requests.get("http://www.mieliestronk.com/corncob_lowercase.txt")
-    wordsearch_words = word_request.text.split("\n")
 
+# Prepare avatars in worker processes and keep them in memory
+avatars = AvatarStore(
+    processes=get_setting("avatar_processes"),
+    max_size=get_setting("avatar_max_size"),
+    max_bytes=get_setting("avatar_max_bytes")
+)
 
 # Store mood and avatar filename
 moods = Config(
     config={},
-    filename="moods"
+    filename="moods",
+    write_behind=True,
+    max_delay=get_setting("config_write_delay"),
+    snapshot_cache=get_setting("config_snapshot_cache")
 )
 
 
@@ -155,73 +425,181 @@ def set_mood(mood, url=None):
         mood = mood.lower()
 
         if url:
-            avatar_request = requests.get(url)
+            avatar_request = web.get(url)
             if avatar_request.ok:
-                avatar_bytes = BytesIO(avatar_request.content)
-                avatar_object = Image.open(avatar_bytes)
-                if not path.exists("avatars/"):
-                    makedirs("avatars/")
-                avatar_object.save("avatars/{}.png".format(mood))
-
-                moods.set(mood, "{}.png".format(mood))
+                moods.set(mood, avatars.prepare(avatar_request.content, timeout=get_setting("avatar_timeout")))
                 moods.save()
-                field["avatar"] = avatar_bytes
 
         if moods.get(mood):
-            avatar_file = open("avatars/{}".format(moods.get(mood)), "rb")
-            avatar_bytes = avatar_file.read()
+            avatar_bytes = avatars.get(moods.get(mood))
 
-            field["avatar"] = avatar_bytes
+            if avatar_bytes:
+                field["avatar"] = avatar_bytes
 
         client.edit_profile(password, **field)
 
 
 # Store reminder alarm dates for !remindme
-# Formats as user_id: date
-reminders = Config(
+# Formats as user_id: [date, ...]
+reminders = keyed_config(
     config={},
     filename="reminders"
 )
+reminders_lock = threading.Lock()
 
+# Run reminders and periodic jobs from a single thread
+# Scheduled reminders format as (user_id, date): event
+scheduler = Scheduler()
+scheduled_reminders = {}
 
-# Send a pm to user whenever they requested to be reminded
-def send_reminder(user_id):
-    private_channel = None
 
-    for member in client.get_all_members():
-        if member.id == user_id:
-            private_channel = member
+def get_reminders(user_id):
+    """
+    :param user_id: id of the user (required)
+    :return: list of dates the user will be reminded at
+    """
+    dates = reminders.get(user_id) or []
+
+    # Reminders used to be stored as a single date per user
+    if not isinstance(dates, list):
+        dates = [dates]
+
+    return dates
+
+
+# Find members and private channels by user id
+user_index = UserIndex()
+
+
+# Send a pm to user whenever they requested to be reminded
+def send_reminder(user_id, date):
+    private_channel = user_index.get(user_id)
 
     if private_channel:
-        client.send_message(private_channel, "Wake up! The time is `%s`." % datetime.now().ctime())
+        outbox.put(private_channel, "Wake up! The time is `%s`." % datetime.now().ctime())
 
-        if reminders.get(user_id):
+    with reminders_lock:
+        scheduled_reminders.pop((user_id, date), None)
+        dates = [d for d in get_reminders(user_id) if not d == date]
+
+        if dates:
+            reminders.set(user_id, dates, save=True)
+        else:
             reminders.remove(user_id, save=True)
 
 
-# Remind the user in x seconds from the specified date
+def schedule_reminder(date, user_id):
+    """
+    Schedule a reminder unless it is already scheduled. Call with reminders_lock held.
+
+    :param date: datetime to remind the user at (required)
+    :param user_id: id of the user (required)
+    """
+    if (user_id, date) not in scheduled_reminders:
+        scheduled_reminders[(user_id, date)] = scheduler.schedule_at(date, send_reminder, user_id, date)
+
+
+# Remind the user at the specified date
 def remind_at(date, user_id):
-    remind_in_seconds = (date - datetime.now()).total_seconds()
+    with reminders_lock:
+        dates = get_reminders(user_id)
 
-    if remind_in_seconds > 1:
-        reminders.set(user_id, date, save=True)
-        remind_thread = threading.Timer(remind_in_seconds, send_reminder, args=[user_id])
-        remind_thread.setDaemon(True)
-        remind_thread.start()
-    else:
-        if reminders.get(user_id):
-            reminders.remove(user_id, save=True)
+        if date not in dates:
+            reminders.set(user_id, dates + [date], save=True)
+
+        schedule_reminder(date, user_id)
+
+
+def restore_reminders():
+    """
+    Schedule every stored reminder, dropping the ones that have passed,
+    and save the reminders once if any were dropped
+    """
+    now = datetime.now()
+    changed = False
+
+    with reminders_lock:
+        for user_id in reminders.get():
+            dates = [date for date in get_reminders(user_id) if date > now]
+
+            for date in dates:
+                schedule_reminder(date, user_id)
+
+            # Only write users whose reminders changed, so unchanged ones add no journal records
+            if dates == reminders.get(user_id):
+                continue
+
+            changed = True
+            if dates:
+                reminders.set(user_id, dates)
+            else:
+                reminders.remove(user_id)
+
+    if changed:
+        reminders.save()
 
 
 # Store globally configured pastas
-pastas = Config(
+pastas = keyed_config(
     config={},
     filename="pastas"
 )
 
 
-# Initialize cleverbot
-cleverbot_client = cleverbot.Cleverbot()
+# Keep a cleverbot conversation per channel
+cleverbot_sessions = SessionPool(
+    cleverbot.Cleverbot,
+    maxsize=get_setting("cleverbot_sessions"),
+    idle_timeout=get_setting("cleverbot_idle_timeout")
+)
+
+# Ask cleverbot on separate workers, so slow answers never take up message or lookup workers
+cleverbot_pool = WorkerPool(
+    workers=get_setting("cleverbot_concurrency"),
+    queue_size=get_setting("cleverbot_queue_size"),
+    name="cleverbot"
+)
+
+# Questions in a channel wait in the channel's queue instead of taking up workers
+cleverbot_channels = KeyedExecutor(cleverbot_pool, max_pending=get_setting("cleverbot_channel_queue_size"))
+
+
+def ask_cleverbot_session(channel_id, question):
+    with cleverbot_sessions.session(channel_id) as session:
+        return session.ask(question)
+
+
+def wait_for_cleverbot(channel_id, question):
+    task = Task(ask_cleverbot_session, (channel_id, question))
+
+    if not cleverbot_channels.submit(channel_id, task.run):
+        raise RateLimitExceeded("Too many questions for cleverbot")
+
+    timeout = get_setting("cleverbot_timeout")
+    limited_timeout = time_left(timeout)
+
+    try:
+        return task.result(limited_timeout)
+    except TaskTimeout:
+        # Only a timeout of the full cleverbot_timeout is the service's fault
+        if limited_timeout != timeout:
+            raise DeadlineExceeded("The deadline passed while waiting for cleverbot")
+
+        raise
+
+
+def ask_cleverbot(channel_id, question):
+    """
+    Ask cleverbot in the conversation of a channel, giving up after
+    cleverbot_timeout seconds or when the message deadline passes.
+    Answers that time out count as failures, so a hanging cleverbot opens the circuit.
+
+    :param channel_id: id of the channel asking (required)
+    :param question: the question to ask (required)
+    :return: cleverbot's answer
+    :raises RateLimitExceeded: when too many questions are waiting already
+    """
+    return cleverbot_breaker.call(wait_for_cleverbot, channel_id, question)
 
 
 def has_permissions(user):
@@ -277,6 +655,66 @@ def pretty_date(time):
     return str(day_diff / 365) + " years ago"
 
 
+def get_json(url, params):
+    """
+    Request url and decode the JSON response. Call this through a circuit breaker.
+
+    :param url: the url to request (required)
+    :param params: dictionary of query parameters (required)
+    :return: the decoded JSON
+    :raises requests.HTTPError: when the service responds with an error status
+    """
+    response = web.get(url, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def osu_api_request(endpoint, params, priority=PRIORITY_COMMAND):
+    """
+    Request the osu! API, caching the response by endpoint and parameters.
+    Ranked beatmaps are cached for longer than anything else.
+
+    :param endpoint: API endpoint, ex: get_user (required)
+    :param params: dictionary of parameters, without the API key (required)
+    :param priority: rate limiter priority, PRIORITY_COMMAND or PRIORITY_PREVIEW
+    :return: the decoded JSON list. Do not change it, as it is shared by the cache
+    """
+    key = (endpoint, tuple(sorted(params.items())))
+    response = osu_cache.get(key)
+
+    if response is not None:
+        return response
+
+    # Share the request with any other thread requesting the same
+    return in_flight.do(("osu", key), fetch_osu_api, endpoint, params, key, priority)
+
+
+def fetch_osu_api(endpoint, params, key, priority):
+    """
+    Request the osu! API within the rate limit and cache the response.
+    Use osu_api_request instead.
+
+    :param endpoint: API endpoint, ex: get_user (required)
+    :param params: dictionary of parameters, without the API key (required)
+    :param key: the cache key for the response (required)
+    :param priority: rate limiter priority (required)
+    :return: the decoded JSON list
+    :raises RateLimitExceeded: when the request waited too long for the rate limiter
+    """
+    osu_limiter.acquire(priority, time_left(get_setting("osu_max_wait")))
+
+    request_params = dict(params)
+    request_params["k"] = osu_api
+    response = osu_breaker.call(get_json, "https://osu.ppy.sh/api/" + endpoint, request_params)
+
+    ttl = get_setting("osu_cache_ttl").get(endpoint)
+    if endpoint == "get_beatmaps" and response and all(int(m["approved"]) in (1, 2, 4) for m in response):
+        ttl = get_setting("osu_cache_ttl").get("ranked_beatmaps")
+
+    osu_cache.set(key, response, ttl)
+    return response
+
+
 def get_osu_stats(user):
     """
     Lookup an osu! user and return information. Does
@@ -286,13 +724,13 @@ def get_osu_stats(user):
     :return: formatted string
     """
     if osu_api:
-        osu_stats_request = requests.get("https://osu.ppy.sh/api/get_user", params={"k": osu_api, "u": user})
+        osu_user = osu_api_request("get_user", {"u": user})
 
         # If not found, override send_message and break with return
-        if len(osu_stats_request.json()) < 1:
+        if len(osu_user) < 1:
             return "No such user :thumbsdown:"
 
-        osu_stats = osu_stats_request.json()[0]
+        osu_stats = dict(osu_user[0])
         osu_stats["country_name"] = pycountry.countries.get(alpha2=osu_stats["country"]).name
         osu_stats["accuracy"] = float(osu_stats["accuracy"])
 
@@ -308,7 +746,7 @@ def get_osu_stats(user):
     return send_message
 
 
-def get_osu_map(beatmap):
+def format_osu_map(beatmap, osu_maps, osu_top_scores):
     """
     Returns osu! beatmap info. If a mapset is specified (s),
     only return some info about the mapset. If a difficulty/version
@@ -318,64 +756,102 @@ def get_osu_map(beatmap):
     :param beatmap: Dictionary with one key, either 's' (mapset) or
                     'b' (version), with the map id as value.
                     Example: {'s', 267767} (required)
+    :param osu_maps: get_beatmaps response for beatmap (required)
+    :param osu_top_scores: get_scores response for beatmap, if it is a version
     :return: string (see above)
     """
     send_message = ""
 
-    if osu_api:
-        osu_map_params = beatmap
-        osu_map_params["k"] = osu_api
+    # If not found, return nothing
+    if not osu_maps:
+        return send_message
+
+    osu_map = dict(osu_maps[0])
+    osu_map["format_length"] = timedelta(seconds=int(osu_map["total_length"]))
+
+    # Send more info when a version is sent
+    if "b" in beatmap:
+        osu_scores = None
+
+        # Use scores if the map has a scoreboard
+        if int(osu_map["approved"]) > 0 and osu_top_scores:
+            osu_scores = dict(osu_top_scores[0])
+
+        # Format message with beatmap and difficulty info
+        osu_map["format_drain"] = timedelta(seconds=int(osu_map["hit_length"]))
+        osu_map["format_stars"] = float(osu_map["difficultyrating"])
+        send_message = "{artist} - {title} // {creator} [{version}]```\n" \
+                       "Length: {format_length} ({format_drain} drain) BPM: {bpm} Max combo: {max_combo}\n" \
+                       "    CS: {diff_size} AR: {diff_approach} OD: {diff_overall} HP: {diff_drain} " \
+                       "Stars: {format_stars:.2f}\n" \
+                       "Favourites: {favourite_count} / Success Rate: {passcount}/{playcount}```".format(**osu_map)
+
+        # If the map has scoreboard, give first player
+        if osu_scores:
+            osu_scores["format_score"] = "{:,}".format(int(osu_scores["score"]))
+            osu_scores["format_pp"] = "{}pp".format(osu_scores["pp"]) if osu_scores["pp"] else "0pp"
+            # Format date. Change hours=8 to whatever your offset is (I've quite frankly forgotten)
+            osu_scores["format_date"] = pretty_date(parse(osu_scores["date"]) - timedelta(hours=8))
+            send_message += "\n{username} is in the lead! ({format_date})```\n" \
+                            "Score: {format_score} / {format_pp}\n" \
+                            "Combo: {maxcombo}x / Misses: {countmiss}\n" \
+                            "       {count300}x300 / {count100}x100 / {count50}x50```".format(**osu_scores)
+
+    # Return map info if no version is selected
+    elif "s" in beatmap:
+        send_message = "{artist} - {title} // {creator}```\n" \
+                       "Length: {format_length} BPM: {bpm}\n" \
+                       "Favourites: {favourite_count}```".format(**osu_map)
 
-        osu_map_request = requests.get("https://osu.ppy.sh/api/get_beatmaps", osu_map_params)
+    return send_message
 
-        # If not found, return nothing
-        if len(osu_map_request.json()) < 1:
-            return send_message
 
-        osu_map = osu_map_request.json()[0]
-        osu_map["format_length"] = timedelta(seconds=int(osu_map["total_length"]))
+def get_osu_maps(beatmaps):
+    """
+    Returns osu! beatmap info for several beatmaps. The beatmap and
+    top score lookups of every beatmap are sent at once, at most
+    lookup_concurrency at a time.
 
-        # Send more info when a version is sent
+    :param beatmaps: list of beatmaps as returned by osu_maps_in (required)
+    :return: list of strings in the same order as beatmaps (see format_osu_map)
+    """
+    if not osu_api:
+        return ["This command is disabled :thumbsdown:" for _ in beatmaps]
+
+    # Top scores are requested together with the beatmap, and ignored if the map has no scoreboard
+    deadline = current_deadline()
+    lookups = []
+    for beatmap in beatmaps:
+        lookups.append(("get_beatmaps", beatmap, deadline))
         if "b" in beatmap:
-            osu_scores = None
-
-            # Get scores if the map has a scoreboard
-            if int(osu_map["approved"]) > 0:
-                osu_scores_params = osu_map_params
-                osu_scores_params["limit"] = 1
-                osu_scores_request = requests.get("https://osu.ppy.sh/api/get_scores", osu_scores_params)
-
-                osu_scores = osu_scores_request.json()[0]
-
-            # Format message with beatmap and difficulty info
-            osu_map["format_drain"] = timedelta(seconds=int(osu_map["hit_length"]))
-            osu_map["format_stars"] = float(osu_map["difficultyrating"])
-            send_message = "{artist} - {title} // {creator} [{version}]```\n" \
-                           "Length: {format_length} ({format_drain} drain) BPM: {bpm} Max combo: {max_combo}\n" \
-                           "    CS: {diff_size} AR: {diff_approach} OD: {diff_overall} HP: {diff_drain} " \
-                           "Stars: {format_stars:.2f}\n" \
-                           "Favourites: {favourite_count} / Success Rate: {passcount}/{playcount}```".format(**osu_map)
-
-            # If the map has scoreboard, give first player
-            if osu_scores:
-                osu_scores["format_score"] = "{:,}".format(int(osu_scores["score"]))
-                osu_scores["format_pp"] = "{}pp".format(osu_scores["pp"]) if osu_scores["pp"] else "0pp"
-                # Format date. Change hours=8 to whatever your offset is (I've quite frankly forgotten)
-                osu_scores["format_date"] = pretty_date(parse(osu_scores["date"]) - timedelta(hours=8))
-                send_message += "\n{username} is in the lead! ({format_date})```\n" \
-                                "Score: {format_score} / {format_pp}\n" \
-                                "Combo: {maxcombo}x / Misses: {countmiss}\n" \
-                                "       {count300}x300 / {count100}x100 / {count50}x50```".format(**osu_scores)
-
-        # Return map info if no version is selected
-        elif "s" in beatmap:
-            send_message = "{artist} - {title} // {creator}```\n" \
-                           "Length: {format_length} BPM: {bpm}\n" \
-                           "Favourites: {favourite_count}```".format(**osu_map)
-    else:
-        send_message = "This command is disabled :thumbsdown:"
+            lookups.append(("get_scores", dict(beatmap, limit=1), deadline))
 
-    return send_message
+    responses = iter(fan_out(lookup_pool, osu_lookup, lookups, get_setting("lookup_concurrency")))
+
+    send_messages = []
+    for beatmap in beatmaps:
+        osu_maps = next(responses)
+        osu_top_scores = next(responses) if "b" in beatmap else None
+        send_messages.append(format_osu_map(beatmap, osu_maps, osu_top_scores))
+
+    return send_messages
+
+
+def osu_lookup(endpoint, params, deadline):
+    """
+    Request the osu! API for a link preview, where a failed request
+    simply gives no preview
+
+    :param endpoint: API endpoint, ex: get_beatmaps (required)
+    :param params: dictionary of parameters, without the API key (required)
+    :param deadline: the Deadline of the message (required)
+    :return: the decoded JSON list, or an empty list if the request failed
+    """
+    try:
+        with deadline_scope(deadline):
+            return osu_api_request(endpoint, params, PRIORITY_PREVIEW)
+    except (requests.RequestException, ValueError, RateLimitExceeded, CircuitOpenError, DeadlineExceeded):
+        return []
 
 
 def get_osu_id(user):
@@ -383,8 +859,7 @@ def get_osu_id(user):
     :param user: Username or ID to retrieve from
     :return: The users ID or none if they can't be found
     """
-    osu_user_request = requests.get("https://osu.ppy.sh/api/get_user", params={"k": osu_api, "u": user})
-    osu_user = osu_user_request.json()
+    osu_user = osu_api_request("get_user", {"u": user})
 
     if osu_user:
         return osu_user[0]["user_id"]
@@ -439,333 +914,575 @@ def osu_maps_in(args):
     return beatmaps
 
 
-# Split string into list and handle keywords
-def handle_message(message):
-    """
-    Handles any input sent to a channel, going through a list of
-    pre-programmed commands and specifiers.
-    (This code is really messy)
+# Return let me google that for you formatted google search
+@commands.command("!lmgtfy", usage="<query ...>", description="let me google that for you~")
+def cmd_lmgtfy(message, args):
+    if len(args) > 1:
+        search_query = "+".join(args[1:])
+        return "http://lmgtfy.com/?q={}".format(search_query)
 
-    Features:
-    --  !lmgtfy, !profile, !stats, !roll, !yn, !story, !wordsearch,
-        !help, !pcbot, ?trigger,
-    --  Handle any words for !story
-    --  Handle any entries (guesses) for !wordsearch
-    --  Handle subreddit references
-    --  Handle beatmap links
-    --  Return a message from Cleverbot when mentioned
+    return ":thumbsdown:"
 
-    :param message: a discord class Message received (required)
-    :return: type string to send back to the channel
+
+# Reply for terms urban dictionary has no definition of
+NO_DEFINITION = "No such word is defined."
+
+
+# Define a word using urban dictionary
+@commands.command("!define", usage="<word/phrase ...>", description="define this!", cost=COST_EXTERNAL)
+def cmd_define(message, args):
+    if len(args) > 1:
+        term = " ".join(args[1:]).lower()
+
+        send_message = define_cache.get(term)
+        if send_message is None:
+            # Share the lookup with any other thread defining the same term
+            send_message = in_flight.do(("define", term), get_definition, term)
+
+            # Terms without a definition may get one soon, so only cache that briefly
+            if send_message == NO_DEFINITION:
+                define_cache.set(term, send_message, ttl=get_setting("define_cache_negative_ttl"))
+            else:
+                define_cache.set(term, send_message)
+
+        return send_message
+
+    return ":thumbsdown:"
+
+
+def get_definition(term):
     """
-    global story_enabled, story
+    Look up a term on urban dictionary
 
-    args = message.content.split()
+    :param term: word or phrase to define (required)
+    :return: the first definition that fits in a message, formatted
+    """
+    send_message = ""
 
-    # Do not lowercase for stories
-    if not args[0].startswith("+"):
-        args[0] = args[0].lower()
+    request_params = {"term": term}
+    definitions = urbandictionary_breaker.call(get_json, "http://api.urbandictionary.com/v0/define",
+                                               request_params).get("list")
+    if definitions:
+        for definition in definitions:
+            if definition.get("example"):
+                definition["example"] = "```%s```" % definition["example"]
+            send_message = "**%(word)s**:\n" \
+                           "%(definition)s\n" \
+                           "%(example)s" % definition
+            if len(send_message) <= 2000:
+                break
+    else:
+        send_message = NO_DEFINITION
 
-    # Initialize message string to return
+    return send_message
+
+
+# Link to osu! profile or set author as user
+@commands.command("!profile", usage="[-m | --me] <user> [*tag]",
+                  description="sends link to osu! profile (assign with -m)", cost=COST_EXTERNAL)
+def cmd_profile(message, args):
     send_message = ""
+    append_message = ""
+
+    # If command ends with a tag, apply the tag
+    if args[-1].startswith("*"):
+        append_message = "#_"
+        reference = args[-1].replace("*", "")
+        if "ranks" in reference or "performance" in reference:
+            reference = "leader"
+        elif reference == "kudosu":
+            reference = "kudos"
+        append_message += reference
+
+    if (len(args) > 1 and not args[-1].startswith("*")) or len(args) > 2:
+        user = " ".join(args[1:])
+        if args[-1].startswith("*"):
+            user = " ".join(args[1:-1])
 
-    # Avoid these comments
-    if len(args) < 1:
-        return
+        # If command is --me
+        if args[1] == "-m" or args[1] == "--me":
+            if len(args) > 2:
+                user = " ".join(args[2:])
 
-    # Return let me google that for you formatted google search
-    elif args[0] == "!lmgtfy":
-        if len(args) > 1:
-            search_query = "+".join(args[1:])
-            send_message = "http://lmgtfy.com/?q={}".format(search_query)
-        else:
-            send_message = ":thumbsdown:"
+                if args[-1].startswith("*"):
+                    user = " ".join(args[2:-1])
 
-    # Define a word using urban dictionary
-    elif args[0] == "!define":
-        if len(args) > 1:
-            request_params = {"term": " ".join(args[1:])}
-            definitions_request = requests.get("http://api.urbandictionary.com/v0/define", request_params)
-            definitions = definitions_request.json().get("list")
-            if definitions:
-                for definition in definitions:
-                    if definition.get("example"):
-                        definition["example"] = "```%s```" % definition["example"]
-                    send_message = "**%(word)s**:\n" \
-                                   "%(definition)s\n" \
-                                   "%(example)s" % definition
-                    if len(send_message) <= 2000:
-                        break
+                if osu_api:
+                    user = get_osu_id(user)
+                    if not user:
+                        return "This user does not exist."
+
+                osu_users.set(message.author.id, user)
+                append_message += "\n*osu! user associated with discord*"
             else:
-                send_message = "No such word is defined."
+                user = osu_users.remove(message.author.id)
+                if user:
+                    send_message = "*Removed discord association with osu! user.*"
+                else:
+                    send_message = "Please use `!profile -m <user>`"
+            osu_users.save()
+
+        if not send_message:
+            send_message = "https://osu.ppy.sh/u/" + user.replace(" ", "%20") + append_message
+    else:
+        user = osu_users.get(message.author.id)
+        if user:
+            send_message = "https://osu.ppy.sh/u/" + user.replace(" ", "%20") + append_message
         else:
-            send_message = ":thumbsdown:"
+            send_message = "You are not associated with any osu! user :thumbsdown: use `!profile -m <user>` to set."
 
-    # Link to osu! profile or set author as user
-    elif args[0] == "!profile":
-        append_message = ""
+    return send_message
 
-        # If command ends with a tag, apply the tag
-        if args[-1].startswith("*"):
-            append_message = "#_"
-            reference = args[-1].replace("*", "")
-            if "ranks" in reference or "performance" in reference:
-                reference = "leader"
-            elif reference == "kudosu":
-                reference = "kudos"
-            append_message += reference
-
-        if (len(args) > 1 and not args[-1].startswith("*")) or len(args) > 2:
-            user = " ".join(args[1:])
-            if args[-1].startswith("*"):
-                user = " ".join(args[1:-1])
-
-            # If command is --me
-            if args[1] == "-m" or args[1] == "--me":
-                if len(args) > 2:
-                    user = " ".join(args[2:])
 
-                    if args[-1].startswith("*"):
-                        user = " ".join(args[2:-1])
+# Give a list of osu! profile stats
+@commands.command("!stats", usage="<user>", description="displays various stats for user", cost=COST_EXTERNAL)
+def cmd_stats(message, args):
+    if len(args) > 1:
+        user = " ".join(args[1:])
+        return get_osu_stats(user)
 
-                    if osu_api:
-                        user = get_osu_id(user)
-                        if not user:
-                            return "This user does not exist."
+    user = osu_users.get(message.author.id)
+    if user:
+        return get_osu_stats(user)
 
-                    osu_users.set(message.author.id, user)
-                    append_message += "\n*osu! user associated with discord*"
-                else:
-                    user = osu_users.remove(message.author.id)
-                    if user:
-                        send_message = "*Removed discord association with osu! user.*"
-                    else:
-                        send_message = "Please use `!profile -m <user>`"
-                osu_users.save()
+    return "You are not associated with any osu! user :thumbsdown: use `!profile -m <user>` to set."
 
-            if not send_message:
-                send_message = "https://osu.ppy.sh/u/" + user.replace(" ", "%20") + append_message
-        else:
-            user = osu_users.get(message.author.id)
-            if user:
-                send_message = "https://osu.ppy.sh/u/" + user.replace(" ", "%20") + append_message
-            else:
-                send_message = "You are not associated with any osu! user :thumbsdown: use `!profile -m <user>` to set."
 
-    # Give a list of osu! profile stats
-    elif args[0] == "!stats":
-        if len(args) > 1:
-            user = " ".join(args[1:])
-            send_message = get_osu_stats(user)
-        else:
-            user = osu_users.get(message.author.id)
-            if user:
-                send_message = get_osu_stats(user)
-            else:
-                send_message = "You are not associated with any osu! user :thumbsdown: use `!profile -m <user>` to set."
+# Roll a dice
+@commands.command("!roll", usage="[range]", description="roll dice")
+def cmd_roll(message, args):
+    roll_n = 100
+    if len(args) > 1:
+        try:
+            roll_n = int(args[1])
+        except ValueError:
+            pass
 
-    # Roll a dice
-    elif args[0] == "!roll":
-        roll_n = 100
-        if len(args) > 1:
-            try:
-                roll_n = int(args[1])
-            except ValueError:
-                pass
-        send_message = "rolls " + str(random.randrange(1, roll_n+1))
+    return "rolls " + str(random.randrange(1, roll_n+1))
 
-    # Very extensive yes or no function
-    elif args[0] == "!yn":
-        yn_list = yn_set.get("default")
 
-        # Update language set
-        if len(args) > 1:
-                if (args[1] == "--set") or (args[1] == "--global-set"):
-                    globally = False
-                    if args[1] == "--global-set":
-                        globally = True
-                    # Clone settings for mentioned channel
-                    if len(message.channel_mentions) > 0:
-                        mentioned_channel = message.channel_mentions[0]  # Set to first one, ignore other mentions
-                        if yn_set.get(mentioned_channel.id):
-                            # Clone settings as default in current server
-                            if globally:
-                                yn_set.set(message.server.id, yn_set.get(mentioned_channel.id))
-                            # Clone settings to current channel
-                            else:
-                                yn_set.set(message.channel.id, yn_set.get(mentioned_channel.id))
-                            send_message = "YN " + ("globally " if globally else "") + "cloned from " + \
-                                           mentioned_channel.mention()
+# Very extensive yes or no function
+@commands.command("!yn", usage="[--set | --global-set [<yes> <no>]]",
+                  description="yes or no (alternatively multiple choice)", cost=COST_STORAGE)
+def cmd_yn(message, args):
+    send_message = ""
+    yn_list = yn_set.get("default")
+
+    # Update language set
+    if len(args) > 1:
+            if (args[1] == "--set") or (args[1] == "--global-set"):
+                globally = False
+                if args[1] == "--global-set":
+                    globally = True
+                # Clone settings for mentioned channel
+                if len(message.channel_mentions) > 0:
+                    mentioned_channel = message.channel_mentions[0]  # Set to first one, ignore other mentions
+                    if yn_set.get(mentioned_channel.id):
+                        # Clone settings as default in current server
+                        if globally:
+                            yn_set.set(message.server.id, yn_set.get(mentioned_channel.id))
+                        # Clone settings to current channel
+                        else:
+                            yn_set.set(message.channel.id, yn_set.get(mentioned_channel.id))
+                        send_message = "YN " + ("globally " if globally else "") + "cloned from " + \
+                                       mentioned_channel.mention()
+                else:
+                    if len(args) > 3:
+                        # Add to list
+                        for i in range(2, len(args)):
+                            args[i] = args[i].replace("_", " ")
+
+                        # Apply list to server
+                        if globally:
+                            yn_set.set(message.server.id, args[2:])
+                        # Apply list to channel
+                        else:
+                            yn_set.set(message.channel.id, args[2:])
+
+                        # Send formatted message
+                        send_message = "YN set to "
+                        for i in range(2, len(args)):
+                            args[i] = "`" + args[i] + "`"
+                        send_message += ",".join(args[2:])
+                        send_message += " for this " + ("server" if globally else "channel")
                     else:
-                        if len(args) > 3:
-                            # Add to list
-                            for i in range(2, len(args)):
-                                args[i] = args[i].replace("_", " ")
-
-                            # Apply list to server
-                            if globally:
-                                yn_set.set(message.server.id, args[2:])
-                            # Apply list to channel
-                            else:
-                                yn_set.set(message.channel.id, args[2:])
-
-                            # Send formatted message
-                            send_message = "YN set to "
-                            for i in range(2, len(args)):
-                                args[i] = "`" + args[i] + "`"
-                            send_message += ",".join(args[2:])
-                            send_message += " for this " + ("server" if globally else "channel")
+                        # Reset server settings
+                        if globally:
+                            yn_set.remove(message.server.id)
+                        # Reset channel settings
                         else:
-                            # Reset server settings
-                            if globally:
-                                yn_set.remove(message.server.id)
-                            # Reset channel settings
-                            else:
-                                yn_set.remove(message.channel.id)
-
-                            send_message = "YN reset for this " + ("server" if globally else "channel")
-                    yn_set.save()
-
-                    # Warn user when the channel is default channel
-                    # (my understanding is that the default channel will have the same id as the server)
-                    if not globally and message.channel.is_default_channel():
-                        send_message += "\n*setting YN for this channel is* ***the same*** *as setting server wide YN*"
-
-        # Return value from list
-        if not send_message:
-            yn_server = yn_set.get(message.server.id)
-            yn_channel = yn_set.get(message.channel.id)
-
-            # Use global server settings if set and not equal to default settings
-            if yn_server:
-                yn_list = yn_server
-
-            # Use channel settings if set and not equal to default settings, overriding any global setting
-            if yn_channel:
-                yn_list = yn_channel
-
-            # Choose from list and send
-            send_message = random.choice(yn_list)
-
-    # Enable or disable story mode
-    elif args[0] == "!story":
-        if story_enabled.get(message.channel.id):  # Check if channel exists and if enabled
-            story_enabled[message.channel.id] = False
-            if story[message.channel.id]:
-                send_message = "Your %s story: ```%s```" % (
-                    random.choice(["amazing", "fantastic", "wonderful", "excellent", "magnificent", "brilliant",
-                                  "genius", "wonderful", "mesmerizing"]),
-                    story[message.channel.id]
-                )
+                            yn_set.remove(message.channel.id)
+
+                        send_message = "YN reset for this " + ("server" if globally else "channel")
+                yn_set.save()
+
+                # Warn user when the channel is default channel
+                # (my understanding is that the default channel will have the same id as the server)
+                if not globally and message.channel.is_default_channel():
+                    send_message += "\n*setting YN for this channel is* ***the same*** *as setting server wide YN*"
+
+    # Return value from list
+    if not send_message:
+        yn_server = yn_set.get(message.server.id)
+        yn_channel = yn_set.get(message.channel.id)
+
+        # Use global server settings if set and not equal to default settings
+        if yn_server:
+            yn_list = yn_server
+
+        # Use channel settings if set and not equal to default settings, overriding any global setting
+        if yn_channel:
+            yn_list = yn_channel
+
+        # Choose from list and send
+        send_message = random.choice(yn_list)
+
+    return send_message
+
+
+# Enable or disable story mode
+@commands.command("!story", description="toggle story mode", stateful=True)
+def cmd_story(message, args):
+    story = stories.pop(message.channel.id)
+
+    if story is None:
+        stories.start(message.channel.id)
+        return "Recording *all words* starting with +, write only + to add new paragraph."
+
+    adjective = random.choice(["amazing", "fantastic", "wonderful", "excellent", "magnificent", "brilliant",
+                               "genius", "wonderful", "mesmerizing"])
+    sent = False
+
+    # Stream the story out in parts below the message length limit of discord, in order
+    try:
+        for part in story.read(1900):
+            if sent:
+                outbox.put(message.channel, ("```%s```" % part).encode("utf-8"))
             else:
-                send_message = "Your story had no words! :thumbsdown:"
-        else:  # Set to True in channel, also defining if undefined
-            story_enabled[message.channel.id] = True
-            story[message.channel.id] = ""
-            send_message = "Recording *all words* starting with +, write only + to add new paragraph."
+                outbox.put(message.channel, message.author.mention() + " " +
+                           ("Your %s story: ```%s```" % (adjective, part)).encode("utf-8"))
+                sent = True
+    finally:
+        story.close()
+
+    if not sent:
+        return "Your story had no words! :thumbsdown:"
+
+    return ""
+
+
+def sweep_idle():
+    """
+    Evict idle stories, wordsearches and cleverbot sessions, save the !define cache
+    and schedule the next sweep
+    """
+    for channel_id in stories.sweep():
+        print("Evicted idle story in channel %s" % channel_id)
+
+    cleverbot_sessions.sweep()
+
+    # Expire wordsearches through the channel's executor, so they never change under a running guess
+    for channel_id, game in list(wordsearch.items()):
+        if game.idle(get_setting("wordsearch_idle_timeout")):
+            channel_executor.submit(channel_id, expire_wordsearch, channel_id)
+
+    # Save the !define cache regularly, so a crash loses little of it
+    # Writing it takes a while, so it's written on a lookup worker instead of the scheduler thread
+    if get_setting("define_cache_persist"):
+        lookup_pool.submit(save_define_cache)
+
+    scheduler.schedule(get_setting("sweep_interval"), sweep_idle)
+
+
+# Begin wordsearch (Users try finding a word set by a host
+@commands.command("!wordsearch", usage="[-a | --auto] [-s | --stop]",
+                  description="start a wordsearch or stop with --stop", cost=COST_STORAGE,
+                  permissions=has_permissions, restricted=("--charset",), stateful=True)
+def cmd_wordsearch(message, args):
+    send_message = ""
+
+    # Change character set
+    if len(args) > 1:
+        if args[1] == "--charset":
+            charset = ""
+
+            if len(args) > 2:
+                charset = args[2].lower()
+
+            channel_charset = wordsearch_characters.get(message.channel.id)
+
+            # Check if channel has a set charset
+            if channel_charset:
+                if not charset:
+                    return "This channels charset is `%s`." % channel_charset
+
+            # The command checks permissions for changing the charset
+            wordsearch_characters.set(message.channel.id, charset)
+            wordsearch_characters.save()
+            return "Channel `!wordsearch` charset set to `%s`." % charset
+
+    if not wordsearch.get(message.channel.id):
+        auto = False
 
-    # Add to story if enabled
-    elif (args[0].startswith("+")) and story_enabled.get(message.channel.id):
-        for n in args:
-            if n == "+":
-                story[message.channel.id] += "\n\n"
-            elif len(n) > 0:
-                if n[0] == "+":
-                    story[message.channel.id] += n[1:] + " "
-                else:
-                    story[message.channel.id] += n + " "
-                    
-    # Begin wordsearch (Users try finding a word set by a host
-    elif args[0] == "!wordsearch":
-        # Change character set
         if len(args) > 1:
-            if args[1] == "--charset":
-                charset = ""
+            if args[1] == "--auto" or args[1] == "-a":
+                word = ""
+                auto = True
+                amount = 1
 
                 if len(args) > 2:
-                    charset = args[2].lower()
+                    try:
+                        amount = int(args[2])
+                    except ValueError:
+                        pass
+
+                if amount > 5:
+                    amount = 5
+                elif amount < 1:
+                    amount = 1
+
+                # Download the list of words if it was not bundled
+                if not wordsearch_words.exists():
+                    set_wordsearch_words()
+
+                if not len(wordsearch_words):
+                    return "The dictionary has no words, so I can't choose one. :thumbsdown:"
 
-                channel_charset = wordsearch_characters.get(message.channel.id)
+                for _ in range(amount):
+                    word += wordsearch_words.choice()
 
-                # Check if channel has a set charset
-                if channel_charset:
-                    if not charset:
-                        return "This channels charset is `%s`." % channel_charset
+                wordsearch[message.channel.id] = WordSearch(message.author.id, word)
+                send_message = "Made me set a word."
 
-                # Change if the user has valid permission settings for the channel
-                if has_permissions(message.author):
-                    wordsearch_characters.set(message.channel.id, charset)
-                    wordsearch_characters.save()
-                    return "Channel `!wordsearch` charset set to `%s`." % charset
+        if not auto:
+            outbox.put(message.channel, "Waiting for {} to choose a word.".format(message.author.mention()))
+            outbox.put(message.author, "Please enter a word!")
+            wordsearch[message.channel.id] = WordSearch(message.author.id)
+
+        wordsearch_hosts[message.author.id] = message.channel.id
+    else:
+        if len(args) > 1:
+            if args[1] == "--stop" or args[1] == "-s":
+                if wordsearch[message.channel.id].host_id == message.author.id or has_permissions(message.author):
+                    end_wordsearch(message.channel.id)
+                    return "Word search cancelled."
                 else:
-                    return "You do not have permissions to use this command."
+                    return "You are not the host of this word search."
 
-        if not wordsearch.get(message.channel.id):
-            auto = False
+        if wordsearch[message.channel.id].word:
+            send_message = "A word search is already in progress. Enter a word ending with `!` to guess the word!"
+        else:
+            send_message = "The host ({}) has yet to set a word!".format(
+                    wordsearch[message.channel.id].host_mention
+            )
 
-            if len(args) > 1:
-                if args[1] == "--auto" or args[1] == "-a":
-                    word = ""
-                    auto = True
-                    amount = 1
+    return send_message
 
-                    if len(args) > 2:
-                        try:
-                            amount = int(args[2])
-                        except ValueError:
-                            pass
 
-                    if amount > 5:
-                        amount = 5
-                    elif amount < 1:
-                        amount = 1
+# Remind users at a set time and date
+@commands.command("!remindme", usage="<at> <time ...>", description="reminds you at any time specified",
+                  cost=COST_STORAGE)
+def cmd_remindme(message, args):
+    if len(args) > 1:
+        if args[1] == "at":
+            if len(args) > 2:
+                try:
+                    remind_time = parse(" ".join(args[2:]), fuzzy=True)
+                except (ValueError, OverflowError):
+                    return "I can not remind you at `%s`" % args[2:]
 
-                    # Download a list of words if not stored in memory
-                    if not wordsearch_words:
-                        set_wordsearch_words()
+                if remind_time < datetime.now():
+                    return "I can only remind you in the future."
 
-                    for _ in range(amount):
-                        word += random.choice(wordsearch_words).strip()
+                remind_at(remind_time, message.author.id)
+                return "I will remind you at `%s`" % remind_time
 
-                    wordsearch[message.channel.id] = {"word": word,
-                                                      "user": message.author}
-                    send_message = "Made me set a word."
+            return "When do you want to be reminded? `!remindme <at> <time ...>`"
 
-            if not auto:
-                client.send_message(message.channel,
-                                    "Waiting for {} to choose a word.".format(message.author.mention()))
-                client.send_message(message.author, "Please enter a word!")
-                wordsearch[message.channel.id] = {"user": message.author}
+    return "Please specify when you want to be reminded: `!remindme <at> <time ...>`"
 
-            wordsearch[message.channel.id]["hint"] = ""
-            wordsearch[message.channel.id]["tries"] = 0
-        else:
-            if len(args) > 1:
-                if args[1] == "--stop" or args[1] == "-s":
-                    if wordsearch[message.channel.id].get("user").id == message.author.id or has_permissions(message.author):
-                        wordsearch.pop(message.channel.id)
-                        return "Word search cancelled."
-                    else:
-                        return "You are not the host of this word search."
 
-            if wordsearch[message.channel.id].get("word"):
-                send_message = "A word search is already in progress. Enter a word ending with `!` to guess the word!"
+# Display or set a copypasta
+@commands.command("!pasta", usage="<copypasta | --add <pastaname> <pasta ...>>", description="pasta",
+                  cost=COST_STORAGE)
+def cmd_pasta(message, args):
+    if len(args) > 1:
+        # Return list of defined copypastas
+        if args[1] == "--list":
+            # Only listing and picking a random pasta need every pasta
+            pasta_list = pastas.get()
+
+            if pasta_list:
+                return "Pastas: `%s`" % "\n".join(pasta_list)
+
+            return "There are no defined pastas. Define with `!pasta --add <pastaname> <copypasta ...>`"
+
+        # Add a copypasta
+        elif args[1] == "--add":
+            if len(args) > 3:
+                pasta_name = args[2].lower()
+                pasta = args[3:]
+                if not pastas.get(pasta_name):
+                    pastas.set(pasta_name, pasta, save=True)
+                    return "Pasta set."
+
+                return "There is already a pasta defined as `%s`." % pasta_name
             else:
-                send_message = "The host ({}) has yet to set a word!".format(
-                        wordsearch[message.channel.id].get("user").mention()
-                )
+                return "Please follow the format of `!pasta --add <pastaname> <copypasta ...>`"
+
+        # Return a desired copypasta, or a random one if arg is .
+        if args[1] == ".":
+            pasta_list = pastas.get()
+
+            if pasta_list:
+                return random.choice(list(pasta_list.values()))
+
+            return "There are no defined pastas. Define with `!pasta --add <pastaname> <copypasta ...>`"
+
+        return pastas.get(args[1].lower()) or \
+            "No such pasta is defined. Define with `!pasta --add <pastaname> <copypasta ...>`"
+
+    return "Please specify the pasta with `!pasta <copypasta>` " \
+           "or add a pasta with `!pasta --add <pastaname> <copypasta ...>`\n" \
+           "Use `!pasta --list` for a list of copypastas."
+
+
+# Display  help command
+@commands.command("!help", hidden=True)
+def cmd_help(message, args):
+    return "`!pcbot`"
+
+
+# Show help, return github link or change settings
+@commands.command("!pcbot", usage="[--git | --reddit | --uptime | --status]", description="display commands",
+                  permissions=has_permissions, restricted=("--mood",))
+def cmd_pcbot(message, args):
+    if len(args) > 1:
+        # Give link to git
+        if args[1] == "--git":
+            return __git_url__
+
+        # Send the bots uptime
+        elif args[1] == "--uptime":
+            return "The server started %s." % pretty_date(start_date)
+
+        # Send the message worker status
+        elif args[1] == "--status":
+            return "Workers: {busy}/{workers} busy ({utilization:.0%}) / " \
+                   "Queue: {queued}/{queue_size} / " \
+                   "Handled: {completed} / Dropped: {rejected}\n".format(**message_pool.stats()) + \
+                   "osu! cache: {hits} hits / {misses} misses / {size}/{maxsize} cached\n".format(**osu_cache.stats()) + \
+                   "!define cache: {hits} hits / {misses} misses / {size}/{maxsize} cached\n".format(
+                       **define_cache.stats()) + \
+                   "osu! rate limit: {waiting} waiting / {dropped} dropped\n".format(**osu_limiter.stats()) + \
+                   "Commands: {cheap} cheap / {storage} storage / {external} external calls\n".format(
+                       **commands.stats()) + \
+                   "Outbox: {queued} queued / {sent} sent / {merged} merged\n".format(**outbox.stats()) + \
+                   "Stories: {stories} / {length} characters / {memory} in memory\n".format(**stories.stats()) + \
+                   "\n".join("{service}: {state} ({failures} failures)".format(**breaker.stats())
+                             for breaker in (osu_breaker, urbandictionary_breaker, cleverbot_breaker)) + "\n" + \
+                   "Cleverbot: {sessions}/{maxsize} sessions / ".format(**cleverbot_sessions.stats()) + \
+                   "{busy}/{workers} busy / Queue: {queued}/{queue_size}".format(**cleverbot_pool.stats())
+
+        # Toggle subreddit functionality
+        elif args[1] == "--reddit":
+            if reddit_settings.get(message.server.id):
+                reddit_settings.set(message.server.id, False)
+                send_message = "*Automatic subreddit linking* ***disabled*** *for this server*"
+            else:
+                reddit_settings.set(message.server.id, True)
+                send_message = "*Automatic subreddit linking* ***enabled*** *for this server*"
+
+            reddit_settings.save()
+            return send_message
+
+        # Change the bots mood
+        elif args[1] == "--mood":
+            # The command checks permissions for changing the mood
+            if len(args) > 2:
+                mood = args[2]
+                url = None
+
+                if len(args) > 3:
+                    url = args[3]
+
+                set_mood(mood, url)
+            return
+
+    # Print list of commands with description
+    return commands.help
+
+
+# Show trigger
+@commands.command("?trigger", hidden=True)
+def cmd_trigger(message, args):
+    return "Trigger is !"
+
+
+# Split string into list and handle keywords
+def handle_message(message):
+    """
+    Handles any input sent to a channel. Commands are looked up in
+    the command registry, anything else goes through a list of
+    pre-programmed specifiers.
+
+    Features:
+    --  Any command registered in commands
+    --  Handle any words for !story
+    --  Handle any entries (guesses) for !wordsearch
+    --  Handle subreddit references
+    --  Handle beatmap links
+    --  Return a message from Cleverbot when mentioned
+
+    :param message: a discord class Message received (required)
+    :return: type string to send back to the channel
+    """
+    args = message.content.split()
+
+    # Avoid these comments
+    if len(args) < 1:
+        return
+
+    # Do not lowercase for stories
+    if not args[0].startswith("+"):
+        args[0] = args[0].lower()
+
+    # Run the command if one is registered with this trigger
+    command = commands.get(args[0])
+    if command:
+        return command(message, args)
+
+    # Initialize message string to return
+    send_message = ""
+
+    # Add to story if enabled
+    if (args[0].startswith("+")) and message.channel.id in stories:
+        text = ""
+        for n in args:
+            if n == "+":
+                text += "\n\n"
+            elif len(n) > 0:
+                if n[0] == "+":
+                    text += n[1:] + " "
+                else:
+                    text += n + " "
+
+        if not stories.append(message.channel.id, text):
+            send_message = "Your story is full! Finish it with !story."
 
     # Add to wordsearch if enabled
     elif args[0].endswith("!") and wordsearch.get(message.channel.id):
+        game = wordsearch[message.channel.id]
         user_word = args[0][:-1]
-        word = wordsearch[message.channel.id].get("word")
-        hint = wordsearch[message.channel.id].get("hint")
+        word = game.word
+        hint = game.hint
         user_hint = ""
         old_hint = user_hint
 
         if word:
-            wordsearch[message.channel.id]["tries"] += 1
-            tries = wordsearch[message.channel.id]["tries"]
+            game.touch()
+            game.tries += 1
+            tries = game.tries
 
             # Update hint
             if user_word.startswith(hint):
@@ -780,7 +1497,7 @@ def handle_message(message):
                     user_hint += c
 
                 # Add the found hint
-                wordsearch[message.channel.id]["hint"] = user_hint
+                game.hint = user_hint
             else:
                 user_hint = hint
 
@@ -796,10 +1513,10 @@ def handle_message(message):
                                        "The word was `%s`!!" % word.upper()
                     else:
                         send_message = "***got it*** after **%d** tries! The word was `%s`." % (
-                                wordsearch[message.channel.id]["tries"],
+                                game.tries,
                                 word
                         )
-                    wordsearch.pop(message.channel.id)
+                    end_wordsearch(message.channel.id)
                     user_hint = ""
                 elif user_word > word:
                     send_message = "`%s` is *after* in the dictionary." % user_word
@@ -811,126 +1528,10 @@ def handle_message(message):
             except UnicodeEncodeError:
                 send_message = "Your word has an unknown character. :thumbsdown:"
 
-    # Remind users at a set time and date
-    elif args[0] == "!remindme":
-        if len(args) > 1:
-            if args[1] == "at":
-                if len(args) > 2:
-                    try:
-                        remind_time = parse(" ".join(args[2:]), fuzzy=True)
-                    except (ValueError, OverflowError):
-                        return "I can not remind you at `%s`" % args[2:]
-
-                    if remind_time < datetime.now():
-                        return "I can only remind you in the future."
-
-                    remind_at(remind_time, message.author.id)
-                    send_message = "I will remind you at `%s`" % remind_time
-                else:
-                    send_message = "When do you want to be reminded? `!remindme <at> <time ...>`"
-            else:
-                send_message = "Please specify when you want to be reminded: `!remindme <at> <time ...>`"
-        else:
-            send_message = "Please specify when you want to be reminded: `!remindme <at> <time ...>`"
-
-    # Display or set a copypasta
-    elif args[0] == "!pasta":
-        if len(args) > 1:
-            pasta_list = pastas.get()
-
-            # Return list of defined copypastas
-            if args[1] == "--list":
-                if pasta_list:
-                    return "Pastas: `%s`" % "\n".join(pasta_list)
-
-                return "There are no defined pastas. Define with `!pasta --add <pastaname> <copypasta ...>`"
-
-            # Add a copypasta
-            elif args[1] == "--add":
-                if len(args) > 3:
-                    pasta_name = args[2].lower()
-                    pasta = args[3:]
-                    if not pastas.get(pasta_name):
-                        pastas.set(pasta_name, pasta, save=True)
-                        return "Pasta set."
-
-                    return "There is already a pasta defined as `%s`." % pasta_name
-                else:
-                    return "Please follow the format of `!pasta --add <pastaname> <copypasta ...>`"
-
-            # Return a desired copypasta, or a random one if arg is .
-            if args[1] == ".":
-                send_message = random.choice(pasta_list)
-            else:
-                send_message = pastas.get(args[1].lower()) or \
-                               "No such pasta is defined. Define with `!pasta --add <pastaname> <copypasta ...>`"
-
-        else:
-            send_message = "Please specify the pasta with `!pasta <copypasta>` " \
-                           "or add a pasta with `!pasta --add <pastaname> <copypasta ...>`\n" \
-                           "Use `!pasta --list` for a list of copypastas."
-
-    # Display  help command
-    elif args[0] == "!help":
-        send_message = "`!pcbot`"
-
-    # Show help, return github link or change settings
-    elif args[0] == "!pcbot":
-        if len(args) > 1:
-            # Give link to git
-            if args[1] == "--git":
-                send_message = __git_url__
-                return send_message
-            
-            # Send the bots uptime
-            elif args[1] == "--uptime":
-                return "The server started %s." % pretty_date(start_date)
-
-            # Toggle subreddit functionality
-            elif args[1] == "--reddit":
-                if reddit_settings.get(message.server.id):
-                    reddit_settings.set(message.server.id, False)
-                    send_message = "*Automatic subreddit linking* ***disabled*** *for this server*"
-                else:
-                    reddit_settings.set(message.server.id, True)
-                    send_message = "*Automatic subreddit linking* ***enabled*** *for this server*"
-
-                reddit_settings.save()
-                return send_message
-
-            # Change the bots mood
-            elif args[1] == "--mood":
-                if len(args) > 2:
-                    if has_permissions(message.author):
-                        mood = args[2]
-                        url = None
-
-                        if len(args) > 3:
-                            url = args[3]
-
-                        set_mood(mood, url)
-                return
-
-        # Print list of commands with description
-        send_message = "Commands: ```"
-        longest_cmd = len(max(usage))  # Return length of longest key
-        space_len = longest_cmd + 4
-        for k, v in usage.items():
-            send_message += "\n" + k + " "*(space_len - len(k)) + v
-        send_message += "```"
-
-    # Show trigger
-    elif args[0] == "?trigger":
-        send_message = "Trigger is !"
-
     # Get map links and display info
     elif osu_maps_in(args):
         beatmaps = osu_maps_in(args)
-        if len(beatmaps) > 0:
-            for i, beatmap in enumerate(beatmaps):
-                send_message += get_osu_map(beatmap)
-                if len(beatmaps) > i+1:
-                    send_message += "\n\n"
+        send_message = "\n\n".join(osu_map for osu_map in get_osu_maps(beatmaps) if osu_map)
 
     # Send reddit link
     elif subreddit_in(args):
@@ -956,7 +1557,7 @@ def handle_message(message):
         # Make sure message was received
         if cleverbot_question:
             client.send_typing(message.channel)
-            send_message = cleverbot_client.ask(cleverbot_question.encode('utf-8'))
+            send_message = ask_cleverbot(message.channel.id, cleverbot_question.encode('utf-8'))
 
     return send_message
 
@@ -975,59 +1576,169 @@ def handle_pm(message):
     send_message = ""
 
     # Check if user is trying to give wordsearch info
-    for channel, value in wordsearch.items():
-        user = value.get("user")
+    channel = wordsearch_hosts.get(message.author.id)
+    game = wordsearch.get(channel)
 
-        if user:
-            if user.id == message.author.id:
-                if len(args[0]) > 1:
-                    if not wordsearch[channel].get("word"):
-                        word = args[0].lower()
-                        # Use only whitelisted characters
-                        valid_chars = wordsearch_characters.get("default")
-                        valid_channel = wordsearch_characters.get(channel)
-                        if valid_channel:
-                            valid_chars = valid_channel
-
-                        for char in word:
-                            valid = False
-                            for valid_char in valid_chars:
-                                if char == valid_char:
-                                    valid = True
-
-                            if not valid:
-                                return "Your word has an invalid character `%s`" % char
-
-                        # Cancel too long words
-                        if len(args[0]) > 32:
-                            return "This word is wicked long! Please choose a shorter one."
-
-                        # Filter out words that don't work
-                        try:
-                            "%s" % args[0]
-                        except UnicodeEncodeError:
-                            return "Your word has an unknown character. :thumbsdown:"
-                        except:
-                            return "This word does not work for some reason. Please contact PC `!pcbot --git`"
-                        wordsearch[channel]["word"] = word
-                        send_message = "Word set to `%s`." % word
-                        client.send_message(
-                                client.get_channel(channel),
-                                "{} has started a word search. Enter a word ending with `!` to guess the word!".format(
-                                    user.mention()
-                                )
-                        )
-                    else:
-                        if not send_message:
-                            send_message = "Word is already set to `%s`." % wordsearch[channel]["word"]
+    if game and len(args[0]) > 1:
+        if not game.word:
+            word = args[0].lower()
+            # Use only whitelisted characters
+            valid_chars = wordsearch_charset(channel)
+
+            for char in word:
+                if char not in valid_chars:
+                    return "Your word has an invalid character `%s`" % char
+
+            # Cancel too long words
+            if len(args[0]) > 32:
+                return "This word is wicked long! Please choose a shorter one."
+
+            # Filter out words that don't work
+            try:
+                "%s" % args[0]
+            except UnicodeEncodeError:
+                return "Your word has an unknown character. :thumbsdown:"
+            except:
+                return "This word does not work for some reason. Please contact PC `!pcbot --git`"
+            game.word = word
+            game.touch()
+            send_message = "Word set to `%s`." % word
+            outbox.put(
+                    client.get_channel(channel),
+                    "{} has started a word search. Enter a word ending with `!` to guess the word!".format(
+                        game.host_mention
+                    )
+            )
+        else:
+            send_message = "Word is already set to `%s`." % game.word
 
     return send_message
 
 
+def is_actionable(message):
+    """
+    Cheaply check whether a message could trigger any response, so that
+    ordinary chatter never reaches the worker pool.
+
+    Actionable messages are private messages from wordsearch hosts, !/? triggers, + story words,
+    word! guesses, osu! and subreddit links and bot mentions.
+
+    :param message: a discord class Message received (required)
+    :return: True if the message should be handled, else False
+    """
+    content = message.content
+
+    if not content:
+        return False
+
+    # Private messages can only set a wordsearch word
+    if message.channel.is_private:
+        return message.author.id in wordsearch_hosts
+
+    content = content.lstrip()
+
+    if content.startswith(("!", "?")):
+        return True
+
+    channel_id = message.channel.id
+
+    if content.startswith("+") and channel_id in stories:
+        return True
+
+    # Only look at the first word when a wordsearch is in progress
+    if wordsearch.get(channel_id) and content.split(None, 1)[0].endswith("!"):
+        return True
+
+    if "osu.ppy.sh" in content or "/r/" in content:
+        return True
+
+    if message.mentions and not message.mention_everyone and client.user in message.mentions:
+        return True
+
+    return False
+
+
+def stateful_key(message):
+    """
+    Find the channel whose story or wordsearch an actionable message may change
+
+    :param message: a discord class Message received (required)
+    :return: id of the channel, or None if the message changes no channel state
+    """
+    # The word of a wordsearch is set through a private message from the host
+    if message.channel.is_private:
+        return wordsearch_hosts.get(message.author.id)
+
+    content = message.content.lstrip()
+    channel_id = message.channel.id
+
+    if content.startswith("+"):
+        return channel_id
+
+    first = content.split(None, 1)[0].lower() if content else ""
+
+    # Wordsearch guesses
+    if first.endswith("!"):
+        return channel_id
+
+    command = commands.get(first)
+    if command and command.stateful:
+        return channel_id
+
+    return None
+
+
 @client.event
 def on_message(message):
-    # Start new thread to handle commands
-    OnMessage(message).start()
+    # Remember private channels for sending private messages
+    if message.channel.is_private:
+        user_index.add_private_channel(message.channel)
+
+    # Skip anything that can't trigger a response
+    if not is_actionable(message):
+        return
+
+    # Queue the message for the worker pool, dropping it when the pool is flooded
+    # Messages changing a story or wordsearch run one at a time per channel
+    key = stateful_key(message)
+
+    if key is None:
+        queued = message_pool.submit(process_message, message)
+    else:
+        queued = channel_executor.submit(key, process_message, message)
+
+    if not queued:
+        print("Message queue is full, dropped message from %s" % message.author.name)
+
+
+@client.event
+def on_member_join(member):
+    user_index.add_member(member)
+
+
+@client.event
+def on_member_remove(member):
+    user_index.remove_member(member)
+
+
+@client.event
+def on_member_update(*members):
+    # Receives the member, or the member before and after the update
+    user_index.add_member(members[-1])
+
+
+@client.event
+def on_server_join(server):
+    user_index.add_server(server)
+
+
+@client.event
+def on_server_remove(server):
+    user_index.remove_server(server)
+
+
+# on_ready runs again on every reconnect
+configs_loaded = False
 
 
 @client.event
@@ -1040,21 +1751,55 @@ def on_ready():
     global start_date
     start_date = datetime.utcnow()
 
-    # Load configuration files
-    yn_set.load()
-    osu_users.load()
-    reddit_settings.load()
-    wordsearch_characters.load()
-    moods.load()
-    reminders.load()
+    # Index every user the bot can send private messages to
+    for server in client.servers:
+        user_index.add_server(server)
+
+    for channel in client.private_channels:
+        user_index.add_private_channel(channel)
+
+    # Configs stay in memory between reconnects, so only load them once
+    global configs_loaded
+    if not configs_loaded:
+        configs_loaded = True
+
+        # Load configuration files and report how long each took
+        for config in (yn_set, osu_users, reddit_settings, wordsearch_characters, moods, reminders, pastas):
+            config.load()
+            print("Loaded %s in %.1f ms" % (config.filename, config.load_time * 1000))
+
+        # Restore !define replies cached by the last run
+        if get_setting("define_cache_persist"):
+            load_define_cache()
+
+        # Keep every mood avatar in memory for instant mood changes
+        avatars.preload(moods.get(mood) for mood in moods.get())
 
     # Set mood to default (no mood) if defined
     if moods.get("default"):
         set_mood("default")
 
-    for user_id, date in reminders.get().items():
-        remind_at(date, user_id)
+    restore_reminders()
+
+
+def stop(signum, frame):
+    """ Exit on SIGTERM like on an interrupt, so pending configs are flushed by atexit """
+    exit(0)
 
 
 if __name__ == "__main__":
+    # Fork the avatar processes before any threads are started
+    avatars.start()
+    message_pool.start()
+    lookup_pool.start()
+    cleverbot_pool.start()
+    outbox.start()
+    scheduler.start()
+    scheduler.schedule(get_setting("sweep_interval"), sweep_idle)
+
+    if get_setting("define_cache_persist"):
+        atexit.register(save_define_cache)
+
+    signal.signal(signal.SIGTERM, stop)
+
     client.run()
@@ -1 +1,15 @@
-from config import Config
\ No newline at end of file
+from config import Config
+from journal import JournalConfig
+from database import SQLiteConfig
+from workers import WorkerPool
+from commands import CommandRegistry
+from web import HTTPClient
+from cache import TTLCache, SingleFlight
+from ratelimit import RateLimiter
+from circuit import CircuitBreaker
+from scheduler import Scheduler
+from users import UserIndex
+from story import StoryStore
+from avatars import AvatarStore
+from sessions import SessionPool
+from outbox import Outbox
\ No newline at end of file
@@ -0,0 +1,146 @@
+from os import path
+from io import BytesIO
+from multiprocessing import Pool, TimeoutError
+import os
+import hashlib
+import threading
+
+from PIL import Image
+
+from workers import TaskTimeout
+from config import _replace
+
+
+def prepare(data, max_size=512, max_bytes=262144):
+    """
+    Decode an image and encode it as a PNG avatar, downscaling it until
+    it fits within max_size pixels and max_bytes. Runs in a worker process.
+
+    :param data: bytes of any image PIL can open (required)
+    :param max_size: largest width and height in pixels
+    :param max_bytes: largest size of the encoded PNG
+    :return: bytes of the PNG
+    """
+    image = Image.open(BytesIO(data))
+
+    # Keep transparency, drop everything else such as palettes and CMYK
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+    else:
+        image = image.convert("RGB")
+
+    size = max_size
+    while True:
+        avatar = image.copy()
+        avatar.thumbnail((size, size), Image.LANCZOS)
+
+        f = BytesIO()
+        avatar.save(f, "PNG", optimize=True)
+        avatar_bytes = f.getvalue()
+
+        if len(avatar_bytes) <= max_bytes or size <= 64:
+            return avatar_bytes
+
+        size = int(size * 0.75)
+
+
+class AvatarStore(object):
+    """
+    Prepares avatars in a pool of processes so decoding large images never
+    blocks a thread of the bot, and keeps the prepared bytes in memory.
+    Avatars are stored in directory, named by the hash of their content,
+    so the same image is only stored once.
+
+    :param directory: -- Directory avatars are stored in (default "avatars")
+    :param processes: -- Number of worker processes (default 2)
+    :param max_size: -- Largest width and height of an avatar in pixels (default 512)
+    :param max_bytes: -- Largest size of an avatar (default 262144)
+    """
+    def __init__(self, directory="avatars", processes=2, max_size=512, max_bytes=262144):
+        self.directory = directory
+        self.processes = processes
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+
+        self._pool = None
+        self._avatars = {}
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """ Start the worker processes. Call before starting any threads. """
+        with self._lock:
+            if self._pool is None:
+                self._pool = Pool(self.processes)
+
+    def prepare(self, data, timeout=None):
+        """
+        Turn an image into an avatar and store it
+
+        :param data: bytes of the downloaded image (required)
+        :param timeout: seconds to wait for the worker process
+        :return: filename of the avatar in directory
+        :raises TaskTimeout: when preparing took longer than timeout
+        """
+        source_hash = hashlib.sha1(data).hexdigest()
+
+        # The same image was already prepared
+        filename = self._sources.get(source_hash)
+        if filename:
+            return filename
+
+        self.start()
+        try:
+            avatar_bytes = self._pool.apply_async(prepare, (data, self.max_size, self.max_bytes)).get(timeout)
+        except TimeoutError:
+            raise TaskTimeout("The avatar was not prepared within %s seconds" % timeout)
+
+        filename = hashlib.sha1(avatar_bytes).hexdigest() + ".png"
+        filepath = path.join(self.directory, filename)
+
+        if not path.isfile(filepath):
+            if not path.exists(self.directory):
+                os.makedirs(self.directory)
+
+            with open(filepath + ".tmp", "wb") as f:
+                f.write(avatar_bytes)
+            _replace(filepath + ".tmp", filepath)
+
+        with self._lock:
+            self._avatars[filename] = avatar_bytes
+            self._sources[source_hash] = filename
+
+        return filename
+
+    def get(self, filename):
+        """
+        :param filename: filename of an avatar in directory (required)
+        :return: bytes of the avatar, read from disk only the first time, or None if it does not exist
+        """
+        avatar_bytes = self._avatars.get(filename)
+        if avatar_bytes is not None:
+            return avatar_bytes
+
+        filepath = path.join(self.directory, filename)
+        if not path.isfile(filepath):
+            return None
+
+        with open(filepath, "rb") as f:
+            avatar_bytes = f.read()
+
+        with self._lock:
+            self._avatars[filename] = avatar_bytes
+
+        return avatar_bytes
+
+    def preload(self, filenames):
+        """
+        Read avatars into memory ahead of time
+
+        :param filenames: filenames of avatars in directory (required)
+        """
+        for filename in filenames:
+            self.get(filename)
+
+    def __len__(self):
+        return len(self._avatars)
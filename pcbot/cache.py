@@ -0,0 +1,144 @@
+import threading
+import time
+from collections import OrderedDict
+
+from workers import Task, TaskTimeout
+from circuit import DeadlineExceeded, current_deadline
+
+
+class TTLCache(object):
+    """
+    A size bounded least recently used cache where every entry expires
+    after a time to live.
+
+    :param maxsize: -- Maximum amount of entries before the least recently used is evicted (default 1024)
+    :param ttl: -- Default seconds an entry lives (default 60)
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        :param key: the key to look up (required)
+        :param default: returned when key is missing or expired
+        :return: the cached value or default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return default
+
+            # Reinsert to mark the entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        :param key: the key to store value as (required)
+        :param value: the value to cache (required)
+        :param ttl: seconds the entry lives, overriding the default
+        """
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def remove(self, key):
+        """ Remove key from the cache if it is cached """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def snapshot(self):
+        """
+        :return: dictionary of unexpired entries as key: [value, expires], where
+                 expires is a unix timestamp
+        """
+        now = time.time()
+
+        with self._lock:
+            return dict((key, [value, expires]) for key, (value, expires) in self._entries.items() if expires > now)
+
+    def restore(self, snapshot):
+        """
+        Add unexpired entries from a snapshot
+
+        :param snapshot: dictionary as returned by snapshot (required)
+        """
+        now = time.time()
+
+        # Restore the entries expiring last, as they are most likely the most recently used
+        for key, (value, expires) in sorted(snapshot.items(), key=lambda item: item[1][1]):
+            if expires > now:
+                self.set(key, value, expires - now)
+
+    def stats(self):
+        """
+        :return: dictionary with hits, misses, size and maxsize
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "maxsize": self.maxsize
+            }
+
+
+class SingleFlight(object):
+    """
+    Concurrent calls made with the same key share a single call
+    and its result, instead of each making their own.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        """
+        Call func, or wait for the call already in flight for key
+
+        :param key: key identifying the call (required)
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: the return value of the call, raising any exception it raised
+        :raises DeadlineExceeded: when the call in flight does not finish before this thread's deadline
+        """
+        with self._lock:
+            task = self._calls.get(key)
+            leader = task is None
+
+            if leader:
+                task = Task(func, args)
+                self._calls[key] = task
+
+        if leader:
+            try:
+                task.run()
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+
+            return task.result()
+
+        # Wait for the call in flight no longer than this thread's own deadline
+        deadline = current_deadline()
+        if deadline is None:
+            return task.result()
+
+        try:
+            return task.result(deadline.remaining())
+        except TaskTimeout:
+            raise DeadlineExceeded("The deadline passed while waiting for the call in flight")
@@ -0,0 +1,165 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling a service that is failing """
+    def __init__(self, service):
+        Exception.__init__(self, "%s is not responding" % service)
+        self.service = service
+
+
+class DeadlineExceeded(Exception):
+    """ Raised when there is no time left to make a call """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a service after failure_threshold failures in a row.
+    After reset_timeout seconds a single probe call is let through, which
+    closes the circuit again if it succeeds.
+
+    :param service: -- Name of the service, used in errors (required)
+    :param failure_threshold: -- Failures in a row before the circuit opens (default 5)
+    :param reset_timeout: -- Seconds the circuit stays open before probing (default 30)
+    :param ignored: -- Exceptions which are not the service's fault, and don't count as failures (default ())
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, service, failure_threshold=5, reset_timeout=30, ignored=()):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.ignored = (DeadlineExceeded,) + tuple(ignored)
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func unless the circuit is open
+
+        :param func: function calling the service (required)
+        :return: the return value of func
+        :raises CircuitOpenError: when the circuit is open
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError(self.service)
+
+                # Let this call through as the probe
+                self.state = self.HALF_OPEN
+            elif self.state == self.HALF_OPEN:
+                raise CircuitOpenError(self.service)
+
+        try:
+            result = func(*args, **kwargs)
+        except self.ignored:
+            # Running out of time, among others, is not the service's fault
+            self._release_probe()
+            raise
+        except Exception:
+            self._failure()
+            raise
+
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+        return result
+
+    def _failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+    def _release_probe(self):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+
+    def stats(self):
+        """
+        :return: dictionary with service, state and failures
+        """
+        with self._lock:
+            return {
+                "service": self.service,
+                "state": self.state,
+                "failures": self.failures
+            }
+
+
+class Deadline(object):
+    """
+    A time budget shared by every call made while handling something
+
+    :param seconds: -- Seconds from now until the deadline (required)
+    """
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        """
+        :return: seconds left until the deadline, never below 0
+        """
+        return max(0, self.expires - time.time())
+
+
+_local = threading.local()
+
+
+def current_deadline():
+    """
+    :return: the Deadline of this thread or None
+    """
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """
+    Use deadline for every call made by this thread within the with block
+
+    :param deadline: a Deadline, or None for no deadline
+    """
+    previous = current_deadline()
+    _local.deadline = deadline
+
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def time_left(timeout):
+    """
+    Limit a timeout to the time left until this thread's deadline
+
+    :param timeout: seconds, or a (connect, read) tuple of seconds (required)
+    :return: timeout limited to the time left
+    :raises DeadlineExceeded: when the deadline has passed
+    """
+    deadline = current_deadline()
+
+    if deadline is None:
+        return timeout
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded("The deadline has passed")
+
+    if isinstance(timeout, tuple):
+        return tuple(min(t, remaining) for t in timeout)
+
+    return min(timeout, remaining)
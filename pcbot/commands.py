@@ -0,0 +1,136 @@
+import threading
+
+# Cost classes, describing what a command does when it's called
+COST_CHEAP = "cheap"        # Pure computation
+COST_STORAGE = "storage"    # Reads or writes configs
+COST_EXTERNAL = "external"  # Calls an external service
+
+
+class Command(object):
+    """
+    A command handler with metadata
+
+    :param trigger: -- The first word of a message that runs the command, ex: !roll (required)
+    :param function: -- Handler called with (message, args), returning a string (required)
+    :param usage: -- Arguments shown in the help text (default "")
+    :param description: -- Description shown in the help text (default "")
+    :param cost: -- Cost class of the command (default COST_CHEAP)
+    :param permissions: -- Function called with the author, returning True if they may run the command (default None)
+    :param restricted: -- Options which need permissions, ex: ("--mood",).
+                          When empty, the whole command needs permissions (default ())
+    :param hidden: -- Leave the command out of the help text (default False)
+    :param stateful: -- The command changes state of the channel and must run in order with its other messages (default False)
+    """
+    def __init__(self, trigger, function, usage="", description="", cost=COST_CHEAP, permissions=None, restricted=(),
+                 hidden=False, stateful=False):
+        self.trigger = trigger
+        self.function = function
+        self.usage = usage
+        self.description = description
+        self.cost = cost
+        self.permissions = permissions
+        self.restricted = restricted
+        self.hidden = hidden
+        self.stateful = stateful
+
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def usage_line(self):
+        """ The trigger followed by usage, ex: !roll [range] """
+        if self.usage:
+            return "{} {}".format(self.trigger, self.usage)
+
+        return self.trigger
+
+    def needs_permissions(self, args):
+        """
+        :param args: the words of the message (required)
+        :return: True if running the command with args needs permissions
+        """
+        if not self.permissions:
+            return False
+
+        if not self.restricted:
+            return True
+
+        return len(args) > 1 and args[1] in self.restricted
+
+    def __call__(self, message, args):
+        if self.needs_permissions(args) and not self.permissions(message.author):
+            return "You do not have permissions to use this command."
+
+        with self._lock:
+            self.calls += 1
+
+        return self.function(message, args)
+
+
+class CommandRegistry(object):
+    """
+    Commands mapped by trigger, dispatched with a single lookup
+    """
+    def __init__(self):
+        self.commands = {}
+        self._order = []
+        self._help = None
+
+    def command(self, trigger, **kwargs):
+        """
+        Decorator registering a function as a command.
+        Takes the same keyword arguments as Command.
+
+        :param trigger: the first word of a message that runs the command (required)
+        """
+        def decorator(function):
+            self.register(Command(trigger, function, **kwargs))
+            return function
+
+        return decorator
+
+    def register(self, command):
+        """
+        Add or replace a command
+
+        :param command: a Command (required)
+        """
+        if command.trigger not in self.commands:
+            self._order.append(command.trigger)
+
+        self.commands[command.trigger] = command
+        self._help = None
+
+    def get(self, trigger):
+        """
+        :param trigger: the first word of a message
+        :return: the Command for trigger or None
+        """
+        return self.commands.get(trigger)
+
+    def stats(self):
+        """
+        :return: dictionary of cost class: amount of calls to commands of that class
+        """
+        calls = dict((cost, 0) for cost in (COST_CHEAP, COST_STORAGE, COST_EXTERNAL))
+
+        for command in list(self.commands.values()):
+            calls[command.cost] = calls.get(command.cost, 0) + command.calls
+
+        return calls
+
+    @property
+    def help(self):
+        """ List of visible commands with descriptions, rendered once """
+        if self._help is None:
+            commands = [self.commands[trigger] for trigger in self._order if not self.commands[trigger].hidden]
+            space_len = max(len(command.usage_line) for command in commands) + 4 if commands else 0
+
+            lines = ["Commands: ```"]
+            for command in commands:
+                lines.append("\n" + command.usage_line + " "*(space_len - len(command.usage_line)) + command.description)
+            lines.append("```")
+
+            self._help = "".join(lines)
+
+        return self._help
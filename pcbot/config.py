@@ -1,34 +1,212 @@
 from os import path
+import os
+import threading
+import atexit
+import time
 import yaml
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Use the libyaml bindings when they're installed
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
+
+# Configs with pending write-behind saves, flushed on shutdown
+_write_behind_configs = []
+
+
+def flush_all():
+    """ Write every dirty write-behind config to disk """
+    for config in list(_write_behind_configs):
+        config.flush()
+
+
+atexit.register(flush_all)
+
+
+def _replace(temp_filename, filename):
+    """
+    Atomically replace filename with temp_filename
+
+    :param temp_filename: the fully written new file (required)
+    :param filename: the file to replace (required)
+    """
+    try:
+        os.rename(temp_filename, filename)
+    except OSError:
+        # Renaming onto an existing file fails on Windows
+        os.remove(filename)
+        os.rename(temp_filename, filename)
+
 
 class Config:
     """
     Creates a configuration yml file of a dictionary
 
+    Configs can be shared between threads. Reads don't lock, writes are
+    serialized, and saving serializes a copy of the config so that writers
+    are never blocked by disk I/O. Values should be replaced with set rather
+    than changed in place.
+
     :param config: -- Initializer for dictionaries (required)
     :param filename: -- Filename for the config, specified without extension (default "config")
+    :param write_behind: -- Coalesce saves into one background write (default False)
+    :param max_delay: -- Seconds a write-behind save may be delayed (default 5)
+    :param snapshot_cache: -- Keep a pickled copy of the file to skip YAML parsing on load (default False)
     """
-    def __init__(self, config, filename="config"):
+    def __init__(self, config, filename="config", write_behind=False, max_delay=5, snapshot_cache=False):
         self.config = config
         self.filename = "{}.yml".format(filename)
+        self.write_behind = write_behind
+        self.max_delay = max_delay
+        self.snapshot_cache = snapshot_cache
+        self.cache_filename = "{}.cache".format(self.filename)
+        self.load_time = None
+
+        self._dirty = False
+        self._timer = None
+        self._flush_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+
+        if write_behind:
+            _write_behind_configs.append(self)
 
     def save(self):
-        """ Write YAML formatted file of dictionary config to filename """
-        f = open(self.filename, "w")
-        f.write(yaml.safe_dump(self.config, encoding="utf-8", allow_unicode=True))
-        f.close()
+        """
+        Write YAML formatted file of dictionary config to filename.
+        In write-behind mode the config is only marked dirty, and written
+        at most max_delay seconds later.
+        """
+        if not self.write_behind:
+            self._write()
+            return
+
+        with self._flush_lock:
+            self._dirty = True
+
+            # A pending flush will pick up this change as well
+            if self._timer:
+                return
+
+            self._timer = threading.Timer(self.max_delay, self.flush)
+            self._timer.setDaemon(True)
+            self._timer.start()
+
+    def flush(self):
+        """ Write the config now if there are any pending changes """
+        with self._flush_lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            if not self._dirty:
+                return
+
+            self._dirty = False
+
+        self._write()
+
+    def _write(self):
+        """ Write a copy of the config, taken without holding the lock during I/O """
+        with self._write_lock:
+            with self._lock:
+                snapshot = dict(self.config)
+
+            self._write_snapshot(snapshot)
+
+    def _write_snapshot(self, snapshot):
+        """
+        Atomically replace filename, so a crash mid-write never leaves a truncated file
+
+        :param snapshot: the dictionary to write (required)
+        """
+        temp_filename = self.filename + ".tmp"
+
+        with open(temp_filename, "wb") as f:
+            f.write(yaml.dump(snapshot, Dumper=SafeDumper, encoding="utf-8", allow_unicode=True))
+            f.flush()
+            os.fsync(f.fileno())
+
+        _replace(temp_filename, self.filename)
+
+        # Cache what was just written, so the next start skips parsing it
+        if self.snapshot_cache:
+            self._write_cache(snapshot)
+
+    def _version(self):
+        """
+        :return: the version of filename the snapshot cache is made from
+        """
+        stat = os.stat(self.filename)
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    def _write_cache(self, config):
+        """
+        Write the snapshot cache for the current version of filename
+
+        :param config: the config filename holds (required)
+        """
+        temp_filename = self.cache_filename + ".tmp"
+        with open(temp_filename, "wb") as f:
+            pickle.dump((self._version(), config), f, pickle.HIGHEST_PROTOCOL)
+
+        _replace(temp_filename, self.cache_filename)
 
     def load(self):
+        """
+        Load the config, storing the time it took in load_time.
+        Pending write-behind changes are written first, so reloading never loses them.
+        """
+        start = time.time()
+        self.flush()
+        self._load()
+        self.load_time = time.time() - start
+
+    def _load(self):
         """
         Set dictionary config to loaded YAML formatted file filnename
         On first time use (or if the file has gone) save default config
         """
-        if path.isfile(self.filename):
-            with open(self.filename, "r") as f:
-                self.config = yaml.load(f.read())
-        else:
-            self.save()
+        with self._write_lock:
+            if path.isfile(self.filename):
+                self.config = self._read()
+            else:
+                self._write()
+
+    def _read(self):
+        """
+        Read the YAML formatted file filename, or the snapshot cache
+        when it was made from the same version of the file
+
+        :return: the loaded config
+        """
+        version = self._version()
+
+        if self.snapshot_cache and path.isfile(self.cache_filename):
+            try:
+                with open(self.cache_filename, "rb") as f:
+                    cached_version, config = pickle.load(f)
+
+                if cached_version == version:
+                    return config
+            except Exception:
+                # A broken cache is simply replaced below
+                pass
+
+        with open(self.filename, "r") as f:
+            config = yaml.load(f, Loader=SafeLoader)
+
+        if self.snapshot_cache:
+            self._write_cache(config)
+
+        return config
 
     def set(self, index, value, save=False):
         """
@@ -38,22 +216,24 @@ class Config:
         :param value: any value, although dictionaries are not very well supported (required)
         :param save: saves config if True
         """
-        self.config[index] = value
+        with self._lock:
+            self.config[index] = value
 
         if save:
             self.save()
 
     def get(self, index=None):
         """
-        Get a value from the config or the config itself
+        Get a value from the config or a copy of the config itself
 
         :param index: the index to return (not required)
-        :return: config index if index is specified, else config
+        :return: config index if index is specified, else a copy of config
         """
         if index:
             return self.config.get(index)
 
-        return self.config
+        with self._lock:
+            return dict(self.config)
 
     def remove(self, index, save=False):
         """
@@ -63,7 +243,8 @@ class Config:
         :param save: saves config if True
         :return: return value of removed key or False
         """
-        popped = self.config.pop(index, False)
+        with self._lock:
+            popped = self.config.pop(index, False)
 
         if save and popped:
             self.save()
@@ -0,0 +1,187 @@
+from os import path
+import threading
+import sqlite3
+import yaml
+
+from config import Config, SafeLoader, SafeDumper
+from journal import JournalConfig
+
+
+# Marks a pending removal of a key
+_removed = object()
+
+
+def _dump(value):
+    return yaml.dump(value, Dumper=SafeDumper, allow_unicode=True)
+
+
+def _load(value):
+    return yaml.load(value, Loader=SafeLoader)
+
+
+class SQLiteConfig(Config):
+    """
+    A Config stored in an SQLite database instead of being held in memory.
+    Keys and values are stored YAML formatted, so anything a Config can
+    store is supported. Changes are kept pending until save, which writes
+    them all in one transaction.
+
+    On first load an existing yml config (and journal) of the same
+    filename is migrated into the database. The database records that
+    the migration is done, so the old files are never imported again.
+
+    :param config: -- Initializer for dictionaries, used when there is nothing to migrate (required)
+    :param filename: -- Filename for the config, specified without extension (default "config")
+    :param kwargs: -- Any other keyword arguments for Config
+    """
+    def __init__(self, config, filename="config", **kwargs):
+        Config.__init__(self, config, filename, **kwargs)
+        self.base_filename = filename
+        self.database_filename = "{}.db".format(filename)
+
+        self._pending = {}
+        self._flushing = {}
+        self._local = threading.local()
+
+    def _connection(self):
+        """ Connections can't be shared between threads, so every thread gets its own """
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = sqlite3.connect(self.database_filename)
+            self._local.connection = connection
+
+        return connection
+
+    def _load(self):
+        """
+        Create the database, migrating the yml config if there is one
+        On first time use (or if the database has gone) save default config
+        """
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+        if connection.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+
+        # Databases from before the meta table were migrated if they have any rows
+        if connection.execute("SELECT 1 FROM config LIMIT 1").fetchone():
+            self._mark_migrated()
+            return
+
+        config = self.config
+        if path.isfile(self.filename) or path.isfile("{}.journal".format(self.base_filename)):
+            migrated = JournalConfig(config={}, filename=self.base_filename)
+            migrated.load()
+            config = migrated.get()
+
+        with self._lock:
+            self._pending.update(config)
+
+        self._write()
+        self._mark_migrated()
+
+    def _mark_migrated(self):
+        connection = self._connection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', '1')")
+
+    def _write(self):
+        """ Write all pending changes in a single transaction """
+        with self._write_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+
+            if not self._flushing:
+                return
+
+            changed = [(_dump(index), _dump(value)) for index, value in self._flushing.items()
+                       if value is not _removed]
+            removed = [(_dump(index),) for index, value in self._flushing.items() if value is _removed]
+
+            connection = self._connection()
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", changed)
+                connection.executemany("DELETE FROM config WHERE key = ?", removed)
+
+            with self._lock:
+                self._flushing = {}
+
+    def set(self, index, value, save=False):
+        """
+        Change the value of a config index
+
+        :param index: any type stored in the config (required)
+        :param value: any value (required)
+        :param save: saves config if True
+        """
+        with self._lock:
+            self._pending[index] = value
+
+        if save:
+            self.save()
+
+    def get(self, index=None):
+        """
+        Get a value from the config or the whole config.
+        Getting the whole config reads every row, so prefer indexed lookups.
+
+        :param index: the index to return (not required)
+        :return: config index if index is specified, else config as a dictionary
+        """
+        if not index:
+            config = dict((_load(key), _load(value)) for key, value in
+                          self._connection().execute("SELECT key, value FROM config"))
+
+            with self._lock:
+                changes = dict(self._flushing)
+                changes.update(self._pending)
+
+            for key, value in changes.items():
+                if value is _removed:
+                    config.pop(key, None)
+                else:
+                    config[key] = value
+
+            return config
+
+        with self._lock:
+            value = self._pending.get(index, self._flushing.get(index))
+
+        if value is _removed:
+            return None
+
+        if value is not None:
+            return value
+
+        row = self._connection().execute("SELECT value FROM config WHERE key = ?", (_dump(index),)).fetchone()
+        if row:
+            return _load(row[0])
+
+        return None
+
+    def remove(self, index, save=False):
+        """
+        Remove a key from the config
+
+        :param index: index or key to remove
+        :param save: saves config if True
+        :return: return value of removed key or False
+        """
+        popped = self.get(index)
+
+        if popped is None:
+            return False
+
+        with self._lock:
+            self._pending[index] = _removed
+
+        if save and popped:
+            self.save()
+
+        return popped
@@ -0,0 +1,35 @@
+import time
+
+
+class WordSearch(object):
+    """
+    The state of a wordsearch in a channel. Only ids are kept, so no
+    discord objects stay alive for as long as the game does.
+
+    :param host_id: -- Id of the user hosting the wordsearch (required)
+    :param word: -- The word to find, or None until the host sets it (default None)
+    """
+    __slots__ = ("host_id", "word", "hint", "tries", "updated")
+
+    def __init__(self, host_id, word=None):
+        self.host_id = host_id
+        self.word = word
+        self.hint = ""
+        self.tries = 0
+        self.updated = time.time()
+
+    @property
+    def host_mention(self):
+        """ Mention of the host, ex: <@1234> """
+        return "<@%s>" % self.host_id
+
+    def touch(self):
+        """ Mark the wordsearch as active """
+        self.updated = time.time()
+
+    def idle(self, timeout):
+        """
+        :param timeout: seconds without activity (required)
+        :return: True if the wordsearch has not been active for timeout seconds
+        """
+        return self.updated < time.time() - timeout
@@ -0,0 +1,160 @@
+from os import path
+import os
+import yaml
+
+from config import Config, SafeLoader, SafeDumper
+
+
+class JournalConfig(Config):
+    """
+    A Config stored as a snapshot and an append-only journal of changes.
+    Saving appends the changed keys to the journal instead of rewriting
+    the whole file, and loading replays the journal onto the snapshot.
+    Every record ends with a "..." document end marker, so a record cut
+    off by a crash is recognized and dropped.
+    The journal is compacted into the snapshot every compact_every records.
+
+    :param config: -- Initializer for dictionaries (required)
+    :param filename: -- Filename for the config, specified without extension (default "config")
+    :param compact_every: -- Journal records to keep before compacting (default 1000)
+    :param kwargs: -- Any other keyword arguments for Config
+    """
+    def __init__(self, config, filename="config", compact_every=1000, **kwargs):
+        Config.__init__(self, config, filename, **kwargs)
+        self.journal_filename = "{}.journal".format(filename)
+        self.compact_every = compact_every
+
+        self._records = []
+        self._journal_length = 0
+
+    def set(self, index, value, save=False):
+        """
+        Change the value of a config index
+
+        :param index: any type stored in the config (required)
+        :param value: any value, although dictionaries are not very well supported (required)
+        :param save: saves config if True
+        """
+        with self._lock:
+            self.config[index] = value
+            self._records.append(["set", index, value])
+
+        if save:
+            self.save()
+
+    def remove(self, index, save=False):
+        """
+        Remove a key from the config
+
+        :param index: index or key to remove
+        :param save: saves config if True
+        :return: return value of removed key or False
+        """
+        with self._lock:
+            if index in self.config:
+                self._records.append(["remove", index, None])
+
+            popped = self.config.pop(index, False)
+
+        if save and popped:
+            self.save()
+
+        return popped
+
+    def _write(self):
+        """ Append any changed keys to the journal, compacting when it grows too long """
+        with self._write_lock:
+            with self._lock:
+                records, self._records = self._records, []
+
+            if not records:
+                return
+
+            if self._journal_length + len(records) >= self.compact_every:
+                self.compact()
+                return
+
+            with open(self.journal_filename, "ab") as f:
+                f.write(yaml.dump_all(records, Dumper=SafeDumper, explicit_start=True, explicit_end=True,
+                                      encoding="utf-8", allow_unicode=True))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._journal_length += len(records)
+
+    def compact(self):
+        """ Write the whole config as a snapshot and empty the journal """
+        with self._write_lock:
+            with self._lock:
+                snapshot = dict(self.config)
+                self._records = []
+
+            self._write_snapshot(snapshot)
+
+            with open(self.journal_filename, "wb"):
+                pass
+
+            self._journal_length = 0
+
+    def _load(self):
+        """
+        Set dictionary config to the loaded snapshot and replay the journal
+        On first time use (or if the files have gone) save default config
+        """
+        with self._write_lock:
+            if path.isfile(self.filename):
+                self.config = self._read()
+
+            self._records = []
+            self._journal_length = 0
+            complete = True
+
+            if path.isfile(self.journal_filename):
+                # Decode first, so marks of the parser index the same characters as the journal
+                with open(self.journal_filename, "rb") as f:
+                    complete = self._replay(f.read().decode("utf-8", "replace"))
+
+            # Start over with a fresh journal when it was cut off or has grown too long
+            if not path.isfile(self.filename) or not complete or self._journal_length >= self.compact_every:
+                self.compact()
+
+    def _replay(self, journal):
+        """
+        Apply journal records to config
+
+        :param journal: YAML documents of [operation, index, value] records
+        :return: False if the journal ended with a broken or unterminated record, else True
+        """
+        # Find the end of the last record with a document end marker
+        end = 0
+        complete = True
+        try:
+            for event in yaml.parse(journal, Loader=SafeLoader):
+                if isinstance(event, yaml.DocumentEndEvent) and event.explicit:
+                    end = event.end_mark.index
+        except yaml.YAMLError:
+            complete = False
+
+        # Anything after it was cut off mid-append
+        if journal[end:].strip():
+            complete = False
+
+        try:
+            for record in yaml.load_all(journal[:end], Loader=SafeLoader):
+                if not isinstance(record, list) or len(record) != 3:
+                    return False
+
+                operation, index, value = record
+
+                if operation == "set":
+                    self.config[index] = value
+                elif operation == "remove":
+                    self.config.pop(index, None)
+                else:
+                    return False
+
+                self._journal_length += 1
+        except yaml.YAMLError:
+            return False
+
+        return complete
@@ -0,0 +1,168 @@
+import threading
+import traceback
+import time
+from collections import OrderedDict, deque
+
+from ratelimit import TokenBucket
+
+
+class Outbox(object):
+    """
+    Sends messages from a single thread, in order per destination. Short
+    messages to the same destination queued within window seconds of each
+    other are merged into one message, and sending is paced per destination
+    and globally.
+
+    :param send: -- Function sending content to a destination, like client.send_message (required)
+    :param window: -- Seconds a message waits for more messages to merge with (default 0.2)
+    :param max_length: -- Maximum length of a merged message in UTF-8 bytes (default 2000)
+    :param channel_rate: -- Messages per second to a single destination (default 1)
+    :param channel_burst: -- Messages at once to a single destination after being idle (default 5)
+    :param global_rate: -- Messages per second to all destinations together (default 20)
+    :param global_burst: -- Messages at once to all destinations together after being idle (default 40)
+    """
+    def __init__(self, send, window=0.2, max_length=2000, channel_rate=1, channel_burst=5,
+                 global_rate=20, global_burst=40):
+        self.send = send
+        self.window = window
+        self.max_length = max_length
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.bucket = TokenBucket(global_rate, global_burst)
+        self.sent = 0
+        self.merged = 0
+
+        # Destinations format as destination id: [destination, deque of (content, queued at), TokenBucket]
+        self._destinations = OrderedDict()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """ Start the sending thread if it is not already running """
+        with self._condition:
+            if self._thread:
+                return
+
+            self._thread = threading.Thread(target=self._run, name="outbox")
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def put(self, destination, content):
+        """
+        Queue a message
+
+        :param destination: a discord class Channel, PrivateChannel or User (required)
+        :param content: the message to send, as unicode or UTF-8 encoded (required)
+        """
+        # Keep all content UTF-8 encoded, so messages can always be merged
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+
+        with self._condition:
+            entry = self._destinations.get(destination.id)
+
+            if entry is None:
+                entry = [destination, deque(), TokenBucket(self.channel_rate, self.channel_burst)]
+                self._destinations[destination.id] = entry
+
+            entry[1].append((content, time.time()))
+            self._condition.notify()
+
+    def _pick(self):
+        """
+        Find a destination whose messages may be sent now. Call with the condition held.
+
+        :return: (destination id, None) if one may send now, else (None, seconds to wait or None)
+        """
+        now = time.time()
+        global_wait = self.bucket.wait_time()
+        wait = None
+
+        for destination_id, (destination, pending, bucket) in list(self._destinations.items()):
+            if not pending:
+                # Forget idle destinations once they could burst again anyway
+                if bucket.full():
+                    del self._destinations[destination_id]
+                continue
+
+            ready = max(pending[0][1] + self.window - now, bucket.wait_time(), global_wait)
+            if ready <= 0:
+                return destination_id, None
+
+            wait = ready if wait is None else min(wait, ready)
+
+        return None, wait
+
+    def _merge(self, pending):
+        """
+        Take as many messages as fit in one. Call with the condition held.
+
+        :return: the merged message
+        """
+        content = pending.popleft()[0]
+
+        while pending and len(content) + 1 + len(pending[0][0]) <= self.max_length:
+            try:
+                merged = content + b"\n" + pending[0][0]
+            except Exception:
+                # Send what can't be merged on its own instead
+                break
+
+            pending.popleft()
+            content = merged
+            self.merged += 1
+
+        return content
+
+    def _next(self):
+        """
+        Wait until a destination may be sent to
+
+        :return: (destination, content) to send
+        """
+        with self._condition:
+            while True:
+                destination_id, wait = self._pick()
+                if destination_id is not None:
+                    break
+
+                self._condition.wait(wait)
+
+            # Move the destination to the end so others get their turn
+            entry = self._destinations.pop(destination_id)
+            self._destinations[destination_id] = entry
+
+            destination, pending, bucket = entry
+            bucket.take()
+            self.bucket.take()
+            return destination, self._merge(pending)
+
+    def _run(self):
+        while True:
+            # Keep the outbox alive no matter what picking, merging or sending does,
+            # since it's the only thread sending messages
+            try:
+                destination, content = self._next()
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            try:
+                self.send(destination, content)
+            except Exception:
+                traceback.print_exc()
+
+            with self._condition:
+                self.sent += 1
+
+    def stats(self):
+        """
+        :return: dictionary with queued messages, destinations and message counters
+        """
+        with self._condition:
+            return {
+                "queued": sum(len(entry[1]) for entry in self._destinations.values()),
+                "destinations": len(self._destinations),
+                "sent": self.sent,
+                "merged": self.merged
+            }
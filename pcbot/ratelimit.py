@@ -0,0 +1,127 @@
+import threading
+import time
+import heapq
+import itertools
+
+
+class RateLimitExceeded(Exception):
+    """ Raised when a call waited too long for the rate limiter """
+    pass
+
+
+class TokenBucket(object):
+    """
+    Allows rate calls per second on average, with bursts of up to burst calls.
+    Not thread safe on its own.
+
+    :param rate: -- Tokens added per second (required)
+    :param burst: -- Maximum amount of stored tokens (required)
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """
+        :return: 0 if a token is available, else the seconds until one is
+        """
+        self._refill()
+
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """
+        Take a token if there is one
+
+        :return: 0 if a token was taken, else the seconds until one is available
+        """
+        wait = self.wait_time()
+
+        if not wait:
+            self.tokens -= 1
+
+        return wait
+
+    def full(self):
+        """
+        :return: True if the bucket has refilled completely
+        """
+        self._refill()
+        return self.tokens >= self.burst
+
+
+class RateLimiter(object):
+    """
+    A thread safe token bucket where waiting calls are let through by
+    priority, lowest first, and in order of arrival within a priority.
+    Calls waiting longer than max_wait are dropped.
+
+    :param rate: -- Calls allowed per second (required)
+    :param burst: -- Calls allowed at once after being idle (required)
+    :param max_wait: -- Seconds a call may wait before it is dropped (default 10)
+    """
+    def __init__(self, rate, burst, max_wait=10):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_wait = max_wait
+        self.dropped = 0
+
+        self._waiting = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority=0, timeout=None):
+        """
+        Wait until the call may be made
+
+        :param priority: lower priorities are let through first (default 0)
+        :param timeout: seconds to wait if shorter than max_wait
+        :raises RateLimitExceeded: when the call waited longer than max_wait or timeout
+        """
+        max_wait = self.max_wait if timeout is None else min(timeout, self.max_wait)
+        entry = (priority, next(self._counter))
+        deadline = time.time() + max_wait
+
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+
+            while True:
+                wait = None
+
+                # Only the first call in the queue may take a token
+                if self._waiting[0] is entry:
+                    wait = self.bucket.take()
+
+                    if not wait:
+                        heapq.heappop(self._waiting)
+                        self._condition.notify_all()
+                        return
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self.dropped += 1
+                    self._condition.notify_all()
+                    raise RateLimitExceeded("Waited more than %s seconds" % max_wait)
+
+                self._condition.wait(min(wait or remaining, remaining))
+
+    def stats(self):
+        """
+        :return: dictionary with waiting and dropped calls
+        """
+        with self._condition:
+            return {
+                "waiting": len(self._waiting),
+                "dropped": self.dropped
+            }
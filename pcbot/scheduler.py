@@ -0,0 +1,94 @@
+import threading
+import traceback
+import heapq
+import itertools
+import time
+from datetime import datetime
+
+
+class Scheduler(object):
+    """
+    Runs functions at given times on a single thread, keeping pending
+    calls in a heap ordered by time. Calls run one at a time, so they
+    should be quick.
+
+    :param name: -- Name of the scheduler thread (default "scheduler")
+    """
+    def __init__(self, name="scheduler"):
+        self.name = name
+
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """ Start the scheduler thread if it is not already running """
+        with self._condition:
+            if self._thread:
+                return
+
+            self._thread = threading.Thread(target=self._run, name=self.name)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def schedule(self, delay, func, *args):
+        """
+        Call func in delay seconds
+
+        :param delay: seconds from now (required)
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: event which can be passed to cancel
+        """
+        event = [time.time() + delay, next(self._counter), func, args, False]
+
+        with self._condition:
+            heapq.heappush(self._heap, event)
+
+            # Wake the thread up if this is now the first event
+            if self._heap[0] is event:
+                self._condition.notify()
+
+        return event
+
+    def schedule_at(self, date, func, *args):
+        """
+        Call func at a local date and time
+
+        :param date: datetime to call func at (required)
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: event which can be passed to cancel
+        """
+        return self.schedule((date - datetime.now()).total_seconds(), func, *args)
+
+    def cancel(self, event):
+        """
+        Stop a scheduled call from being made
+
+        :param event: event returned by schedule (required)
+        """
+        with self._condition:
+            event[4] = True
+
+    def __len__(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._condition.wait(self._heap[0][0] - time.time() if self._heap else None)
+
+                when, _, func, args, cancelled = heapq.heappop(self._heap)
+
+            if cancelled:
+                continue
+
+            try:
+                func(*args)
+            except Exception:
+                # Keep the scheduler alive no matter what the call does
+                traceback.print_exc()
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Session(object):
+    """
+    A session of a SessionPool
+
+    :param value: -- The object created by the factory of the pool (required)
+    """
+    def __init__(self, value):
+        self.value = value
+        self.used = time.time()
+
+
+class SessionPool(object):
+    """
+    Sessions by key, such as a chat session per channel. Sessions idle for
+    longer than idle_timeout are evicted, and the least recently used
+    session is evicted when there are more than maxsize. Sessions are not
+    locked, so calls using the same key should be made one at a time.
+
+    :param factory: -- Function returning a new session (required)
+    :param maxsize: -- Maximum amount of sessions (default 64)
+    :param idle_timeout: -- Seconds a session may go unused before it is evicted (default 1800)
+    """
+    def __init__(self, factory, maxsize=64, idle_timeout=1800):
+        self.factory = factory
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.created = 0
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _usable(self, session):
+        return session is not None and session.used >= time.time() - self.idle_timeout
+
+    def _get(self, key):
+        with self._lock:
+            session = self._sessions.pop(key, None)
+
+            if self._usable(session):
+                # Reinsert to mark the session as most recently used
+                self._sessions[key] = session
+                return session
+
+        # Creating a session may be slow, so don't hold up other keys meanwhile
+        new_session = Session(self.factory())
+
+        with self._lock:
+            session = self._sessions.pop(key, None)
+
+            if not self._usable(session):
+                session = new_session
+                self.created += 1
+
+            self._sessions[key] = session
+
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+
+            return session
+
+    @contextmanager
+    def session(self, key):
+        """
+        Use the session of key, creating it if there is none
+
+        :param key: key of the session, such as a channel id (required)
+        :return: context manager giving the value of the session
+        """
+        session = self._get(key)
+
+        try:
+            yield session.value
+        finally:
+            session.used = time.time()
+
+    def sweep(self):
+        """
+        Evict sessions that have been idle for longer than idle_timeout
+
+        :return: amount of evicted sessions
+        """
+        expired = time.time() - self.idle_timeout
+
+        with self._lock:
+            evicted = [key for key, session in self._sessions.items() if session.used < expired]
+
+            for key in evicted:
+                self._sessions.pop(key)
+
+        return len(evicted)
+
+    def stats(self):
+        """
+        :return: dictionary with the amount of sessions and sessions created
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "maxsize": self.maxsize,
+                "created": self.created
+            }
+
+    def __len__(self):
+        return len(self._sessions)
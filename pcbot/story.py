@@ -0,0 +1,188 @@
+import threading
+import tempfile
+import codecs
+import time
+
+
+class StoryBuffer(object):
+    """
+    The text of a story, appended in chunks. When more than spill_size
+    characters are held in memory, they are moved to a temporary file.
+
+    :param spill_size: -- Characters held in memory before spilling to disk (default 65536)
+    """
+    __slots__ = ("spill_size", "length", "memory", "updated", "_chunks", "_file")
+
+    def __init__(self, spill_size=65536):
+        self.spill_size = spill_size
+        self.length = 0
+        self.memory = 0
+        self.updated = time.time()
+
+        self._chunks = []
+        self._file = None
+
+    def append(self, text):
+        """
+        :param text: text to add to the end of the story (required)
+        """
+        self._chunks.append(text)
+        self.length += len(text)
+        self.memory += len(text)
+        self.updated = time.time()
+
+        if self.memory > self.spill_size:
+            self.spill()
+
+    def spill(self):
+        """ Move the text held in memory to the temporary file """
+        if not self._chunks:
+            return
+
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+
+        self._file.seek(0, 2)
+        self._file.write(u"".join(self._chunks).encode("utf-8"))
+        self._chunks = []
+        self.memory = 0
+
+    def read(self, size):
+        """
+        Read the story in parts
+
+        :param size: maximum amount of characters in a part (required)
+        :return: generator of strings
+        """
+        if self._file is not None:
+            self._file.seek(0)
+            reader = codecs.getreader("utf-8")(self._file)
+
+            while True:
+                part = reader.read(chars=size)
+                if not part:
+                    break
+
+                yield part
+
+        text = u"".join(self._chunks)
+        for i in range(0, len(text), size):
+            yield text[i:i + size]
+
+    def close(self):
+        """ Remove the temporary file if there is one """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StoryStore(object):
+    """
+    Story buffers by channel, limiting the size of each story and the
+    text held in memory by all stories together.
+
+    :param max_length: -- Maximum characters in a single story (default 100000)
+    :param max_memory: -- Maximum characters held in memory by all stories (default 1000000)
+    :param spill_size: -- Characters a story holds in memory before spilling to disk (default 65536)
+    :param idle_timeout: -- Seconds without new words before a story is evicted (default 86400)
+    """
+    def __init__(self, max_length=100000, max_memory=1000000, spill_size=65536, idle_timeout=86400):
+        self.max_length = max_length
+        self.max_memory = max_memory
+        self.spill_size = spill_size
+        self.idle_timeout = idle_timeout
+        self.memory = 0
+
+        self._stories = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, channel_id):
+        return channel_id in self._stories
+
+    def start(self, channel_id):
+        """
+        Start a new, empty story in a channel, replacing any story in it
+
+        :param channel_id: id of the channel (required)
+        """
+        with self._lock:
+            self._remove(channel_id)
+            self._stories[channel_id] = StoryBuffer(self.spill_size)
+
+    def append(self, channel_id, text):
+        """
+        Add text to the story of a channel
+
+        :param channel_id: id of the channel (required)
+        :param text: text to add (required)
+        :return: False if there is no story or it is full, else True
+        """
+        with self._lock:
+            story = self._stories.get(channel_id)
+
+            if story is None or story.length + len(text) > self.max_length:
+                return False
+
+            memory = story.memory
+            story.append(text)
+            self.memory += story.memory - memory
+
+            # Spill the stories holding the most memory until under the limit
+            if self.memory > self.max_memory:
+                for s in sorted(self._stories.values(), key=lambda s: s.memory, reverse=True):
+                    if self.memory <= self.max_memory:
+                        break
+
+                    self.memory -= s.memory
+                    s.spill()
+
+            return True
+
+    def pop(self, channel_id):
+        """
+        Remove the story of a channel. Close it when done reading it.
+
+        :param channel_id: id of the channel (required)
+        :return: the StoryBuffer or None
+        """
+        with self._lock:
+            story = self._stories.pop(channel_id, None)
+
+            if story:
+                self.memory -= story.memory
+
+            return story
+
+    def _remove(self, channel_id):
+        story = self._stories.pop(channel_id, None)
+
+        if story:
+            self.memory -= story.memory
+            story.close()
+
+    def sweep(self):
+        """
+        Evict stories that have been idle for longer than idle_timeout
+
+        :return: list of channel ids whose story was evicted
+        """
+        expired = time.time() - self.idle_timeout
+
+        with self._lock:
+            evicted = [channel_id for channel_id, story in self._stories.items() if story.updated < expired]
+
+            for channel_id in evicted:
+                self._remove(channel_id)
+
+        return evicted
+
+    def stats(self):
+        """
+        :return: dictionary with the amount of stories, their length and the memory they use
+        """
+        with self._lock:
+            return {
+                "stories": len(self._stories),
+                "length": sum(s.length for s in self._stories.values()),
+                "memory": self.memory
+            }
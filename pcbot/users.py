@@ -0,0 +1,75 @@
+import threading
+
+
+class UserIndex(object):
+    """
+    Finds a member or private channel by user id without going through
+    every member of every server. Keep it updated from the member and
+    server events of the client.
+    """
+    def __init__(self):
+        self._members = {}
+        self._private_channels = {}
+        self._lock = threading.Lock()
+
+    def add_member(self, member):
+        """
+        :param member: a discord class Member joining or updated in a server (required)
+        """
+        with self._lock:
+            self._members.setdefault(member.id, {})[member.server.id] = member
+
+    def remove_member(self, member):
+        """
+        :param member: a discord class Member leaving a server (required)
+        """
+        with self._lock:
+            servers = self._members.get(member.id)
+
+            if servers:
+                servers.pop(member.server.id, None)
+
+                if not servers:
+                    self._members.pop(member.id)
+
+    def add_server(self, server):
+        """
+        :param server: a discord class Server the client joined (required)
+        """
+        for member in server.members:
+            self.add_member(member)
+
+    def remove_server(self, server):
+        """
+        :param server: a discord class Server the client left (required)
+        """
+        for member in server.members:
+            self.remove_member(member)
+
+    def add_private_channel(self, channel):
+        """
+        :param channel: a discord class PrivateChannel (required)
+        """
+        with self._lock:
+            self._private_channels[channel.user.id] = channel
+
+    def get(self, user_id):
+        """
+        :param user_id: id of the user (required)
+        :return: the private channel with the user if there is one, else a
+                 member of the user from any server, else None
+        """
+        private_channel = self._private_channels.get(user_id)
+        if private_channel:
+            return private_channel
+
+        servers = self._members.get(user_id)
+        if servers:
+            # Copy the values since another thread may change them
+            for member in list(servers.values()):
+                return member
+
+        return None
+
+    def __len__(self):
+        return len(self._members)
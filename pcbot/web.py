@@ -0,0 +1,71 @@
+import threading
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit import DeadlineExceeded, time_left
+
+
+class HTTPClient(object):
+    """
+    Keeps one requests session per host, so connections are kept alive
+    and reused between calls. Every request has a connect and read timeout,
+    which is shortened to fit the deadline of the calling thread.
+
+    :param pool_size: -- Connections kept alive per host (default 10)
+    :param connect_timeout: -- Seconds to wait for a connection (default 3.05)
+    :param read_timeout: -- Seconds to wait for a response (default 10)
+    """
+    def __init__(self, pool_size=10, connect_timeout=3.05, read_timeout=10):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        """
+        :param url: any url on the host (required)
+        :return: the session for the scheme and host of url
+        """
+        parsed_url = urlparse(url)
+        host = (parsed_url.scheme, parsed_url.netloc)
+
+        session = self._sessions.get(host)
+        if session:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(host)
+
+            if not session:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session = requests.Session()
+                session.mount("{}://".format(parsed_url.scheme), adapter)
+                self._sessions[host] = session
+
+        return session
+
+    def get(self, url, params=None, timeout=None):
+        """
+        Send a GET request through the session for the host of url
+
+        :param url: the url to request (required)
+        :param params: dictionary of query parameters
+        :param timeout: (connect, read) timeout overriding the default
+        :return: requests.Response
+        :raises DeadlineExceeded: when the deadline of the calling thread has passed, or the
+                                  request timed out after its timeout was shortened to fit it
+        """
+        timeout = timeout or self.timeout
+        limited_timeout = time_left(timeout)
+
+        try:
+            return self.session(url).get(url, params=params, timeout=limited_timeout)
+        except requests.Timeout:
+            # Running out of the deadline is not the service's fault
+            if limited_timeout != timeout:
+                raise DeadlineExceeded("The deadline passed while waiting for %s" % url)
+
+            raise
@@ -0,0 +1,172 @@
+from os import path
+from array import array
+from bisect import bisect_left
+import sys
+import mmap
+import random
+import threading
+
+from config import _replace
+
+# Word list shipped next to the package, built with build()
+DEFAULT_PATH = path.join(path.dirname(path.abspath(__file__)), "words")
+
+# Builds write to the same temporary files, so only one may run at a time
+_build_lock = threading.Lock()
+
+
+def build(words, filename=DEFAULT_PATH):
+    """
+    Write words in the compact word list format: filename.dat holds every
+    word back to back, and filename.idx holds the offset of every word.
+    Words are sorted by length, so every length is a contiguous range.
+
+    :param words: iterable of words, surrounding whitespace is stripped (required)
+    :param filename: path of the word list, specified without extension
+    :return: the amount of words written
+    """
+    unique_words = set(word.strip().lower() for word in words)
+    unique_words.discard("")
+    sorted_words = sorted(unique_words, key=lambda word: (len(word), word))
+
+    offsets = array("I", [0])
+
+    with _build_lock:
+        with open(filename + ".dat.tmp", "wb") as f:
+            for word in sorted_words:
+                encoded = word.encode("utf-8")
+                f.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+
+        with open(filename + ".idx.tmp", "wb") as f:
+            offsets.tofile(f)
+
+        for extension in (".dat", ".idx"):
+            _replace(filename + extension + ".tmp", filename + extension)
+
+    return len(sorted_words)
+
+
+class WordList(object):
+    """
+    A read-only word list, memory mapped from the files written by build.
+    Nothing is read until the list is first used.
+
+    :param filename: -- Path of the word list, specified without extension (default DEFAULT_PATH)
+    """
+    def __init__(self, filename=DEFAULT_PATH):
+        self.filename = filename
+
+        self._words = None
+        self._offsets = None
+        self._buckets = None
+        self._lock = threading.Lock()
+
+    def exists(self):
+        """
+        :return: True if the word list has been built
+        """
+        return path.isfile(self.filename + ".dat") and path.isfile(self.filename + ".idx")
+
+    def _load(self):
+        with self._lock:
+            if self._offsets is not None:
+                return
+
+            offsets = array("I")
+            with open(self.filename + ".idx", "rb") as f:
+                offsets.fromfile(f, path.getsize(self.filename + ".idx") // offsets.itemsize)
+
+            if offsets[-1] > 0:
+                with open(self.filename + ".dat", "rb") as f:
+                    self._words = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self._offsets = offsets
+
+    def __len__(self):
+        self._load()
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        self._load()
+
+        if not 0 <= i < len(self._offsets) - 1:
+            raise IndexError("word index out of range")
+
+        return self._words[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def _length(self, i):
+        return self._offsets[i + 1] - self._offsets[i]
+
+    def buckets(self):
+        """
+        :return: dictionary of word length: (first index, end index)
+        """
+        self._load()
+
+        if self._buckets is None:
+            buckets = {}
+            lengths = _Lengths(self)
+            start = 0
+            end = len(self._offsets) - 1
+
+            # Words are sorted by length, so jump from one length to the next
+            while start < end:
+                length = self._length(start)
+                bucket_end = bisect_left(lengths, length + 1, start, end)
+                buckets[length] = (start, bucket_end)
+                start = bucket_end
+
+            self._buckets = buckets
+
+        return self._buckets
+
+    def choice(self, min_length=None, max_length=None):
+        """
+        Pick a random word, optionally within a range of lengths
+
+        :param min_length: shortest allowed word length
+        :param max_length: longest allowed word length
+        :return: a random word, or None if no word is allowed
+        """
+        if min_length is None and max_length is None:
+            if not len(self):
+                return None
+
+            return self[random.randrange(len(self))]
+
+        ranges = [r for length, r in self.buckets().items()
+                  if (min_length is None or length >= min_length) and (max_length is None or length <= max_length)]
+        total = sum(end - start for start, end in ranges)
+
+        if not total:
+            return None
+
+        # Pick an index across all allowed ranges
+        i = random.randrange(total)
+        for start, end in ranges:
+            if i < end - start:
+                return self[start + i]
+            i -= end - start
+
+
+class _Lengths(object):
+    """ Word lengths of a WordList as a sequence, for bisecting """
+    def __init__(self, word_list):
+        self.word_list = word_list
+
+    def __getitem__(self, i):
+        return self.word_list._length(i)
+
+    def __len__(self):
+        return len(self.word_list)
+
+
+if __name__ == "__main__":
+    # Build the bundled word list from a text file with one word per line
+    if len(sys.argv) < 2:
+        print("usage: python -m pcbot.wordlist <words.txt>")
+        sys.exit(0)
+
+    with open(sys.argv[1], "rb") as f:
+        print("Wrote %d words" % build(line.decode("utf-8") for line in f))
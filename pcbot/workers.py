@@ -0,0 +1,251 @@
+import threading
+import traceback
+from Queue import Queue, Full
+from collections import deque
+
+
+class TaskTimeout(Exception):
+    """ Raised when waiting for a task takes longer than the timeout """
+    pass
+
+
+class Task(object):
+    """
+    A function call whose result can be waited for
+
+    :param func: -- Function to call (required)
+    :param args: -- Arguments passed to func
+    """
+    def __init__(self, func, args=()):
+        self.func = func
+        self.args = args
+
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def run(self):
+        """ Call the function and store its result or exception """
+        try:
+            self._result = self.func(*self.args)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the call to finish
+
+        :param timeout: seconds to wait, forever if None
+        :return: the return value of the call, raising any exception it raised
+        :raises TaskTimeout: when the call did not finish within timeout
+        """
+        if not self._done.wait(timeout):
+            raise TaskTimeout("The task did not finish within %s seconds" % timeout)
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads consuming tasks from a bounded queue.
+    When the queue is full, new tasks are rejected instead of spawning
+    more threads.
+
+    :param workers: -- Number of worker threads (default 8)
+    :param queue_size: -- Maximum amount of waiting tasks (default 256)
+    :param name: -- Name prefix for the worker threads (default "worker")
+    """
+    def __init__(self, workers=8, queue_size=256, name="worker"):
+        self.workers = workers
+        self.queue = Queue(maxsize=queue_size)
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def start(self):
+        """ Start the worker threads if they are not already running """
+        with self._lock:
+            if self._threads:
+                return
+
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name="{}-{}".format(self.name, i))
+                thread.setDaemon(True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, func, *args):
+        """
+        Queue a function to be called by a worker
+
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: True if the task was queued, False if the queue is full
+        """
+        try:
+            self.queue.put_nowait((func, args))
+        except Full:
+            with self._lock:
+                self._rejected += 1
+            return False
+
+        return True
+
+    def call(self, func, *args):
+        """
+        Call a function on a worker, or in this thread when the queue is full
+
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: a Task to wait for the result with
+        """
+        task = Task(func, args)
+
+        if not self.submit(task.run):
+            task.run()
+
+        return task
+
+    def _work(self):
+        while True:
+            func, args = self.queue.get()
+
+            with self._lock:
+                self._busy += 1
+
+            try:
+                func(*args)
+            except Exception:
+                # Keep the worker alive no matter what the task does
+                traceback.print_exc()
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._completed += 1
+
+                self.queue.task_done()
+
+    def stats(self):
+        """
+        :return: dictionary with queue depth, busy workers, utilization and task counters
+        """
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "utilization": float(self._busy) / self.workers if self.workers else 0.0,
+                "queued": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "completed": self._completed,
+                "rejected": self._rejected
+            }
+
+
+class KeyedExecutor(object):
+    """
+    Runs calls on a WorkerPool one at a time per key, in the order they
+    were submitted. Calls with different keys still run in parallel.
+
+    :param pool: -- The WorkerPool to run calls on (required)
+    :param batch: -- Calls run for a key before letting other tasks in the pool go first (default 16)
+    :param max_pending: -- Maximum amount of waiting calls per key (default 256)
+    """
+    def __init__(self, pool, batch=16, max_pending=256):
+        self.pool = pool
+        self.batch = batch
+        self.max_pending = max_pending
+
+        # Keys with calls to run format as key: deque of (func, args)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        """
+        Queue a function to be called after every call already queued for key
+
+        :param key: key to order calls by, ex: a channel id (required)
+        :param func: function to call (required)
+        :param args: arguments passed to func
+        :return: True if the call was queued, False if the pool or the queue of key is full
+        """
+        with self._lock:
+            pending = self._pending.get(key)
+
+            # A worker is already draining this key
+            if pending is not None:
+                if len(pending) >= self.max_pending:
+                    return False
+
+                pending.append((func, args))
+                return True
+
+            self._pending[key] = deque([(func, args)])
+
+            if not self.pool.submit(self._drain, key):
+                del self._pending[key]
+                return False
+
+        return True
+
+    def _drain(self, key):
+        while True:
+            for _ in range(self.batch):
+                with self._lock:
+                    pending = self._pending[key]
+
+                    if not pending:
+                        del self._pending[key]
+                        return
+
+                    func, args = pending.popleft()
+
+                try:
+                    func(*args)
+                except Exception:
+                    traceback.print_exc()
+
+            # Queue the rest behind other tasks, or keep going when the pool is full
+            with self._lock:
+                if not self._pending[key]:
+                    del self._pending[key]
+                    return
+
+            if self.pool.submit(self._drain, key):
+                return
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+
+def fan_out(pool, func, calls, limit=4):
+    """
+    Call func once for every argument tuple in calls on a pool, running
+    at most limit calls at once.
+
+    :param pool: the WorkerPool to run calls on (required)
+    :param func: function to call (required)
+    :param calls: list of argument tuples for func (required)
+    :param limit: maximum amount of calls running at once (default 4)
+    :return: list of results in the same order as calls
+    """
+    tasks = [pool.call(func, *args) for args in calls[:limit]]
+    results = []
+
+    for i in range(len(calls)):
+        results.append(tasks[i].result())
+
+        # Start the next call once the oldest running call has finished
+        if i + limit < len(calls):
+            tasks.append(pool.call(func, *calls[i + limit]))
+
+    return results